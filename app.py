@@ -1,6 +1,8 @@
 import io
 import json
 import os
+import time
+from contextlib import asynccontextmanager
 from typing import Literal, Optional
 
 import httpx
@@ -16,15 +18,26 @@ from fastapi import (
     WebSocketDisconnect,
     status,
 )
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from PIL import Image
 from pydantic import BaseModel
 
-from core.models import Llama31Model, MinillmModel
+from core.models import (
+    CrossEncoderReranker,
+    EmbeddingCache,
+    HttpPool,
+    Llama31Model,
+    MinillmModel,
+    ModelLifecycle,
+    OllamaReranker,
+)
 from service.agent import Agent
-from tools.logger import config_logger
+from service.pools import RerankerService
+from tools.logger import config_logger, payload
+from tools.metrics import METRICS, observe, timer
 from tools.redis_handler import RedisNotifier
+from tools.trace_context import get_span_id, new_request
 from tools.user_register import UserHandler
 
 model_server_url = os.environ.get("OllAMA_HOST", "127.0.0.1")
@@ -58,11 +71,6 @@ class FeedBack(BaseModel):
 
 # ----------------------Check feedback data ,end----------------------
 
-# feedback call api
-client = httpx.Client()
-app = FastAPI()
-user_handler = UserHandler()
-
 # init log
 logger = config_logger(
     log_name="system.log",
@@ -71,23 +79,161 @@ logger = config_logger(
     write_mode="w",
     level="debug",
 )
-redis = RedisNotifier()
 
-# Init model
-gen_text_model = Llama31Model(
-    host=model_server_url, port=model_server_port, redis=redis
-)
-logger.info(
-    f"Success init model to Gen text. model name = '{gen_text_model.model_name}'"
-)
-text_emb_model = MinillmModel(host=model_server_url, port=model_server_port)
-logger.info(
-    f"Success init model to Embedding text. model name = '{text_emb_model.model_name}'"
-)
+# with several workers, the state which must be shared between them lives in Redis
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+shared_state = os.environ.get("SHARED_STATE", "1" if workers > 1 else "0") == "1"
+
+# built in every worker by lifespan(), not at import time
+http_pool: Optional[HttpPool] = None
+user_handler: Optional[UserHandler] = None
+redis: Optional[RedisNotifier] = None
+model_lifecycle: Optional[ModelLifecycle] = None
+embedding_cache: Optional[EmbeddingCache] = None
+agent: Optional[Agent] = None
+
+
+def init_services() -> None:
+    """
+    Build the connections, models and services of this worker.
+    """
+    global http_pool, user_handler, redis, model_lifecycle, embedding_cache, agent
+
+    # shared connection pool for ollama and feedback call api
+    http_pool = HttpPool(
+        max_connections=int(os.environ.get("HTTP_POOL_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.environ.get("HTTP_POOL_MAX_KEEPALIVE", "20")),
+    )
+    redis = RedisNotifier()
+    user_handler = UserHandler(
+        max_open_logs=int(os.environ.get("USER_LOG_MAX_OPEN", "256")),
+        redis=redis if shared_state else None,
+    )
+
+    # Init model
+    # keep_alive is a duration like "30m" or seconds, -1 keeps the model loaded forever
+    keep_alive = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+    idle_release = os.environ.get("MODEL_IDLE_RELEASE")
+    # span ids go back to each request in process, redis copies are optional
+    shared = "1" if shared_state else "0"
+    gen_text_model = Llama31Model(
+        host=model_server_url,
+        port=model_server_port,
+        redis=redis if os.environ.get("SPAN_ID_REDIS", shared) == "1" else None,
+        pool=http_pool,
+        keep_alive=int(keep_alive) if keep_alive.lstrip("-").isdigit() else keep_alive,
+    )
+    model_lifecycle = ModelLifecycle(
+        model=gen_text_model,
+        idle_release=float(idle_release) if idle_release else None,
+        redis=redis if shared_state else None,
+    )
+    logger.info(
+        f"Success init model to Gen text. model name = '{gen_text_model.model_name}'"
+    )
+    embedding_cache = EmbeddingCache(
+        max_size=int(os.environ.get("EMBEDDING_CACHE_SIZE", "4096")),
+        ttl=float(os.environ.get("EMBEDDING_CACHE_TTL", "3600")),
+        redis=redis if os.environ.get("EMBEDDING_CACHE_REDIS", shared) == "1" else None,
+    )
+    text_emb_model = MinillmModel(
+        host=model_server_url, port=model_server_port, pool=http_pool, cache=embedding_cache
+    )
+    logger.info(
+        f"Success init model to Embedding text. model name = '{text_emb_model.model_name}'"
+    )
+
+    # off, cross_encoder (needs sentence-transformers) or ollama
+    reranker_backend = os.environ.get("RERANKER", "off")
+    reranker = None
+    if reranker_backend != "off":
+        if reranker_backend == "cross_encoder":
+            reranker_model = CrossEncoderReranker(
+                model_name=os.environ.get(
+                    "RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"
+                )
+            )
+        elif reranker_backend == "ollama":
+            reranker_model = OllamaReranker(
+                model_name=os.environ.get("RERANKER_MODEL", "llama3.1"),
+                host=model_server_url,
+                port=model_server_port,
+                pool=http_pool,
+            )
+        else:
+            raise ValueError(f"Unknown RERANKER '{reranker_backend}'!")
+        threshold = os.environ.get("RERANKER_THRESHOLD")
+        reranker = RerankerService(
+            model=reranker_model,
+            top_n=int(os.environ.get("RERANKER_TOP_N", "4")),
+            score_threshold=float(threshold) if threshold else None,
+        )
+        logger.info(f"Success init reranker. model name = '{reranker_model.model_name}'")
+
+    # init Service
+    agent = Agent(
+        gen_text_model=gen_text_model,
+        text_emb_model=text_emb_model,
+        semantic_cache=os.environ.get("SEMANTIC_CACHE", "0") == "1",
+        semantic_cache_kwargs={
+            "threshold": float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.05")),
+            "max_size": int(os.environ.get("SEMANTIC_CACHE_SIZE", "1024")),
+            "ttl": float(os.environ.get("SEMANTIC_CACHE_TTL", "86400")),
+            "redis": redis if shared_state else None,
+        },
+        prompt_kwargs={
+            "context_budget": int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1500")),
+            # opt-in, unset estimates the tokens without loading anything
+            "tokenizer": os.environ.get("PROMPT_TOKENIZER") or None,
+            "template_version": os.environ.get("PROMPT_TEMPLATE_VERSION") or None,
+            "system_template": os.environ.get("PROMPT_SYSTEM_TEMPLATE", "chat_system") or None,
+        },
+        retrieval_mode=os.environ.get("RETRIEVAL_MODE", "vector"),
+        code_lookup=os.environ.get("CODE_LOOKUP", "boost"),
+        reranker=reranker,
+        memory=os.environ.get("CONVERSATION_MEMORY", "0") == "1",
+        memory_kwargs={
+            "redis": redis,
+            "window": int(os.environ.get("MEMORY_WINDOW", "6")),
+            "token_budget": int(os.environ.get("MEMORY_TOKEN_BUDGET", "1024")),
+            "ttl": int(os.environ.get("MEMORY_TTL", "604800")),
+            "condense": os.environ.get("MEMORY_CONDENSE", "1") == "1",
+        },
+    )
+    logger.info("Success init Agent")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_services()
+    logger.info(f"Worker {os.getpid()} ready, shared state = {shared_state}.")
+    await model_lifecycle.astart(warm=os.environ.get("MODEL_WARM_UP", "1") == "1")
+    yield
+    await model_lifecycle.astop()
+    user_handler.close()
+    await http_pool.aclose()
+    logger.info("Success close http connection pool")
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/metrics", tags=["Monitor"])
+def metrics():
+    """
+    Per-stage latency histograms with p50/p95/p99, in the Prometheus text format.
+    """
+    return PlainTextResponse(
+        METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
 
-# init Service
-agent = Agent(gen_text_model=gen_text_model, text_emb_model=text_emb_model)
-logger.info("Success init Agent")
+@app.get("/model/", tags=["Monitor"])
+def model_status():
+    """
+    State of the generation model and the latency of cold and warm generations.
+    """
+    return JSONResponse(content=model_lifecycle.status())
 
 
 @app.post("/chat/", tags=["Chat"])
@@ -96,34 +242,155 @@ async def chat(
     department: str,
     file: Optional[UploadFile] = File(None),
     prompt: Optional[str] = Form(None),
+    mode: Optional[Literal["vector", "hybrid"]] = None,
 ):
     response = {}
-    if not user_handler.check(username=username, department=department):
+    if not await user_handler.acheck(username=username, department=department):
         response["message"] = f"User '{username}' has not registered yet."
         return response
 
-    logger.info(f"user : '{username}'")
-    logger.info(f"user prompt : {prompt}")
+    request_id = new_request()
+    logger.info(f"user : '{username}' , request id : '{request_id}'")
+    logger.info(f"user prompt : {payload(prompt)}")
     # try:
     #     contents = await file.read()
     #     image = Image.open(io.BytesIO(contents))
     # except:
     #     image = None
 
-    llm_answer = agent.chat(
-        log=user_handler.get(username=username, department=department), prompt=prompt
+    with timer("request"):
+        llm_answer = await agent.achat(
+            log=user_handler.get(username=username, department=department),
+            prompt=prompt,
+            mode=mode,
+            user=user_handler.user_id(username=username, department=department),
+        )
+    response["message"] = llm_answer
+    response["span_id"] = get_span_id()
+    response["request_id"] = request_id
+    logger.info(f"Chat bot answer : {payload(response)}")
+    print(response)
+    return JSONResponse(content=response)
+
+
+@app.post("/chat/stream/", tags=["Chat"])
+async def chat_stream(
+    username: str,
+    department: str,
+    prompt: Optional[str] = Form(None),
+    mode: Optional[Literal["vector", "hybrid"]] = None,
+):
+    """
+    Stream the answer as Server-Sent Events.
+
+    Every token is sent as a `token` event, the last `end` event carries the span_id and retrieval metadata.
+    """
+    if not await user_handler.acheck(username=username, department=department):
+        return {"message": f"User '{username}' has not registered yet."}
+
+    start = time.perf_counter()
+    request_id = new_request()
+    logger.info(f"user : '{username}' , request id : '{request_id}'")
+    logger.info(f"user prompt : {payload(prompt)}")
+    retrieval, tokens = await agent.astream_chat(
+        log=user_handler.get(username=username, department=department),
+        prompt=prompt,
+        mode=mode,
+        user=user_handler.user_id(username=username, department=department),
     )
-    span_id = redis.get_value()
 
-    response["message"] = llm_answer
+    def sse(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def event_stream():
+        first_token = True
+        async for token in tokens:
+            if first_token:
+                first_token = False
+                observe("request_ttft", time.perf_counter() - start)
+                logger.info(f"Time to first token : {time.perf_counter() - start:.3f}s")
+            yield sse("token", {"token": token})
+        end = {
+            "span_id": get_span_id(),
+            "request_id": request_id,
+            "retrieval": retrieval,
+        }
+        observe("request", time.perf_counter() - start)
+        logger.info(f"Chat bot stream end : {end}")
+        yield sse("end", end)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@app.websocket("/ws/chat/")
+async def chat_websocket(websocket: WebSocket):
+    """
+    Stream answers over a WebSocket.
+
+    The client sends `{"username", "department", "prompt"}` messages, with an optional
+    `"mode"` ("vector" or "hybrid") retrieval mode, and receives
+    `{"type": "token"}` frames followed by one `{"type": "end"}` frame per answer.
+    """
+    await websocket.accept()
     try:
-        response["span_id"] = span_id.decode("utf-8")
+        while True:
+            request = await websocket.receive_json()
+            username = request.get("username", "")
+            department = request.get("department", "")
+            prompt = request.get("prompt")
+            mode = request.get("mode")
+            if mode not in (None, "vector", "hybrid"):
+                await websocket.send_json(
+                    {"type": "error", "message": f"Unknown retrieval mode '{mode}'."}
+                )
+                continue
+            if not await user_handler.acheck(username=username, department=department):
+                await websocket.send_json(
+                    {
+                        "type": "error",
+                        "message": f"User '{username}' has not registered yet.",
+                    }
+                )
+                continue
+
+            start = time.perf_counter()
+            request_id = new_request()
+            logger.info(f"user : '{username}' , request id : '{request_id}'")
+            logger.info(f"user prompt : {payload(prompt)}")
+            retrieval, tokens = await agent.astream_chat(
+                log=user_handler.get(username=username, department=department),
+                prompt=prompt,
+                mode=mode,
+                user=user_handler.user_id(username=username, department=department),
+            )
+            first_token = True
+            async for token in tokens:
+                if first_token:
+                    first_token = False
+                    observe("request_ttft", time.perf_counter() - start)
+                    logger.info(
+                        f"Time to first token : {time.perf_counter() - start:.3f}s"
+                    )
+                await websocket.send_json({"type": "token", "token": token})
+            end = {
+                "type": "end",
+                "span_id": get_span_id(),
+                "request_id": request_id,
+                "retrieval": retrieval,
+            }
+            observe("request", time.perf_counter() - start)
+            logger.info(f"Chat bot stream end : {end}")
+            await websocket.send_json(end)
+    except WebSocketDisconnect:
+        logger.info("WebSocket chat disconnected")
 
-    except:
-        response["span_id"] = None
-    logger.info(f"Chat bot answer : {response}")
-    print(response)
-    return JSONResponse(content=response)
+
+@app.get("/cache/stats/", tags=["Monitor"])
+def cache_stats():
+    content = {"embedding": embedding_cache.stats()}
+    if agent.semantic_cache is not None:
+        content["answer"] = agent.semantic_cache.stats()
+    return JSONResponse(content=content)
 
 
 @app.post("/feedback/")
@@ -144,7 +411,7 @@ def feedback(feedback: FeedBack):
         ]
     }
 
-    client.post(
+    http_pool.client.post(
         f"http://{os.environ['PHOENIX_HOST']}:{os.environ['PHOENIX_PORT']}/v1/span_annotations?sync=false",
         json=annotation_payload,
     )
@@ -184,6 +451,25 @@ def report(username: str, department: str, feedback: str):
     return JSONResponse(content=response)
 
 
+@app.delete("/memory/", tags=["Chat"])
+def forget(username: str, department: str):
+    """
+    Forget the conversation memory of a user, the next question starts a new conversation.
+    """
+    response = {}
+    if not user_handler.check(username=username, department=department):
+        response["message"] = f"User '{username}' has not registered yet."
+        return response
+    if agent.memory is None:
+        response["message"] = "Conversation memory is disabled."
+        return response
+    agent.memory.clear(
+        user=user_handler.user_id(username=username, department=department)
+    )
+    response["message"] = f"User '{username}' , Department : '{department}' memory cleared!"
+    return JSONResponse(content=response)
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -1,3 +1,5 @@
+from collections.abc import AsyncGenerator
+
 from core.models.pattern import Text2Text
 
 from .pattern import HandlerPattern
@@ -14,8 +16,14 @@ class GenText(HandlerPattern):
         model (Text2Text): The Text2Text model used for text generation.
 
     Methods:
-        run(prompt: list, max_tokens: int = 350) -> str:
+        run(prompt: list, max_tokens: int = 350, notify_span: bool = True) -> str:
             Generate text based on the provided prompt and maximum number of tokens.
+
+        arun(prompt: list, max_tokens: int = 350, notify_span: bool = True) -> str:
+            Asynchronously generate text based on the provided prompt and maximum number of tokens.
+
+        astream(prompt: list, max_tokens: int = 350, notify_span: bool = True) -> AsyncGenerator[str]:
+            Asynchronously yield tokens as soon as the model generates them.
     """
 
     def __init__(self, model: Text2Text) -> None:
@@ -50,23 +58,67 @@ class GenText(HandlerPattern):
             f"GenText must create by model which type is 'Text2Text'! But Input type is '{type(model)}' , More info: model name is '{model.model_name}'."
         )
 
-    def run(self, prompt: list, max_tokens: int = 350) -> str:
+    def run(self, prompt: list, max_tokens: int = 350, notify_span: bool = True) -> str:
         """
         Generate text based on the provided prompt and maximum number of tokens.
 
         Args:
             prompt (list): A list of prompts for text generation.
             max_tokens (int, optional): The maximum number of tokens for the generated text. Defaults to 350.
+            notify_span (bool, optional): Hand the span id of the generation to the request, False for internal generations. Defaults to True.
 
         Returns:
             str: The generated text.
         """
         answer = ""
-        for data in self.model.run(prompt=prompt, max_tokens=max_tokens):
+        for data in self.model.run(
+            prompt=prompt, max_tokens=max_tokens, notify_span=notify_span
+        ):
             if isinstance(data, str):
                 answer += data  # Assume result is a full string
         return answer
 
+    async def arun(
+        self, prompt: list, max_tokens: int = 350, notify_span: bool = True
+    ) -> str:
+        """
+        Asynchronously generate text based on the provided prompt and maximum number of tokens.
+
+        Args:
+            prompt (list): A list of prompts for text generation.
+            max_tokens (int, optional): The maximum number of tokens for the generated text. Defaults to 350.
+            notify_span (bool, optional): Hand the span id of the generation to the request, False for internal generations. Defaults to True.
+
+        Returns:
+            str: The generated text.
+        """
+        answer = ""
+        async for data in self.astream(
+            prompt=prompt, max_tokens=max_tokens, notify_span=notify_span
+        ):
+            answer += data
+        return answer
+
+    async def astream(
+        self, prompt: list, max_tokens: int = 350, notify_span: bool = True
+    ) -> AsyncGenerator[str]:
+        """
+        Asynchronously yield tokens as soon as the model generates them.
+
+        Args:
+            prompt (list): A list of prompts for text generation.
+            max_tokens (int, optional): The maximum number of tokens for the generated text. Defaults to 350.
+            notify_span (bool, optional): Hand the span id of the generation to the request, False for internal generations. Defaults to True.
+
+        Yields:
+            str: The generated tokens.
+        """
+        async for data in self.model.arun(
+            prompt=prompt, max_tokens=max_tokens, notify_span=notify_span
+        ):
+            if isinstance(data, str):
+                yield data
+
 
 if __name__ == "__main__":
     from core.models.ollama import Llama31Model
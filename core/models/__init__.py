@@ -1,4 +1,8 @@
+from .cache import EmbeddingCache
+from .client import HttpPool
+from .lifecycle import ModelLifecycle
 from .minillm import MinillmModel
 from .ollama import Llama31Model
+from .reranker import CrossEncoderReranker, OllamaReranker
 
-__all__ = ['MinillmModel','Llama31Model']
\ No newline at end of file
+__all__ = ['EmbeddingCache','HttpPool','ModelLifecycle','MinillmModel','Llama31Model','CrossEncoderReranker','OllamaReranker']
\ No newline at end of file
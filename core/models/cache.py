@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from tools.logger import config_logger
+from tools.redis_handler import RedisNotifier
+
+# init log
+LOGGER = config_logger(
+    log_name="embedding_cache.log",
+    logger_name="embedding_cache",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+
+class EmbeddingCache:
+    """
+    LRU cache with TTL for text embeddings.
+
+    Entries are keyed on the model name plus the normalized text. The in-process
+    LRU is always used, a Redis connection can be added so that every worker
+    shares the same embeddings.
+
+    Attributes:
+        max_size (int): Maximum number of entries kept in process.
+        ttl (float): Seconds an entry stays valid.
+        hits (int): Number of lookups answered by the cache.
+        misses (int): Number of lookups that needed the model.
+
+    Methods:
+        get(model_name: str, text: str) -> Optional[List[float]]:
+            Get a cached embedding.
+
+        set(model_name: str, text: str, vector: List[float]) -> None:
+            Cache an embedding.
+
+        aget(model_name: str, text: str) -> Optional[List[float]]:
+            Get a cached embedding without blocking the event loop.
+
+        aset(model_name: str, text: str, vector: List[float]) -> None:
+            Cache an embedding without blocking the event loop.
+
+        stats() -> dict:
+            Hit/miss counters for monitoring.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 4096,
+        ttl: float = 3600,
+        redis: Optional[RedisNotifier] = None,
+        prefix: str = "embedding",
+    ) -> None:
+        """
+        Initialize the EmbeddingCache.
+
+        Args:
+            max_size (int): Maximum number of entries kept in process. Defaults to 4096.
+            ttl (float): Seconds an entry stays valid. Defaults to 3600.
+            redis (Optional[RedisNotifier]): Shared Redis connection, None keeps the cache in process only. Defaults to None.
+            prefix (str): Prefix of the Redis keys. Defaults to "embedding".
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis = redis
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.redis_hits = 0
+        self._store: "OrderedDict[str, Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        # all-minilm is uncased, so case and extra whitespace do not change the embedding.
+        return re.sub(r"\s+", " ", text).strip().lower()
+
+    def _key(self, model_name: str, text: str) -> str:
+        digest = hashlib.sha256(
+            f"{model_name}\0{self._normalize(text)}".encode("utf-8")
+        ).hexdigest()
+        return f"{self.prefix}:{digest}"
+
+    def _get_local(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._store.get(key)
+            if entry is None:
+                return None
+            expire_time, vector = entry
+            if expire_time < time.monotonic():
+                del self._store[key]
+                return None
+            self._store.move_to_end(key)
+            return vector
+
+    def _set_local(self, key: str, vector: List[float]) -> None:
+        with self._lock:
+            self._store[key] = (time.monotonic() + self.ttl, vector)
+            self._store.move_to_end(key)
+            while len(self._store) > self.max_size:
+                self._store.popitem(last=False)
+
+    def _get_redis(self, key: str) -> Optional[List[float]]:
+        if self.redis is None:
+            return None
+        try:
+            value = self.redis.get_value(key=key)
+        except Exception as e:
+            LOGGER.warning(f"Redis embedding cache read failed: {e}")
+            return None
+        if value is None:
+            return None
+        return array("d", value).tolist()
+
+    def _set_redis(self, key: str, vector: List[float]) -> None:
+        if self.redis is None:
+            return
+        try:
+            self.redis.set_value(
+                key=key, value=array("d", vector).tobytes(), expire=int(self.ttl)
+            )
+        except Exception as e:
+            LOGGER.warning(f"Redis embedding cache write failed: {e}")
+
+    def get(self, model_name: str, text: str) -> Optional[List[float]]:
+        """
+        Get a cached embedding.
+
+        Args:
+            model_name (str): Name of the embedding model.
+            text (str): The embedded text.
+
+        Returns:
+            Optional[List[float]]: The cached vector, None on a miss.
+        """
+        key = self._key(model_name=model_name, text=text)
+        vector = self._get_local(key)
+        if vector is None:
+            vector = self._get_redis(key)
+            if vector is not None:
+                self.redis_hits += 1
+                self._set_local(key, vector)
+        self._count(vector)
+        return vector
+
+    def set(self, model_name: str, text: str, vector: List[float]) -> None:
+        """
+        Cache an embedding.
+
+        Args:
+            model_name (str): Name of the embedding model.
+            text (str): The embedded text.
+            vector (List[float]): The embedding vector.
+        """
+        key = self._key(model_name=model_name, text=text)
+        self._set_local(key, vector)
+        self._set_redis(key, vector)
+
+    def _count(self, vector: Optional[List[float]]) -> None:
+        if vector is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    async def aget(self, model_name: str, text: str) -> Optional[List[float]]:
+        """
+        Get a cached embedding, the Redis lookup runs in a worker thread.
+
+        Args:
+            model_name (str): Name of the embedding model.
+            text (str): The embedded text.
+
+        Returns:
+            Optional[List[float]]: The cached vector, None on a miss.
+        """
+        key = self._key(model_name=model_name, text=text)
+        vector = self._get_local(key)
+        if vector is None and self.redis is not None:
+            vector = await asyncio.to_thread(self._get_redis, key)
+            if vector is not None:
+                self.redis_hits += 1
+                self._set_local(key, vector)
+        self._count(vector)
+        return vector
+
+    async def aset(self, model_name: str, text: str, vector: List[float]) -> None:
+        """
+        Cache an embedding, the Redis write runs in a worker thread.
+
+        Args:
+            model_name (str): Name of the embedding model.
+            text (str): The embedded text.
+            vector (List[float]): The embedding vector.
+        """
+        key = self._key(model_name=model_name, text=text)
+        self._set_local(key, vector)
+        if self.redis is not None:
+            await asyncio.to_thread(self._set_redis, key, vector)
+
+    def stats(self) -> dict:
+        """
+        Hit/miss counters for monitoring.
+
+        Returns:
+            dict: Counters, hit rate and current size.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "redis_hits": self.redis_hits,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._store),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "shared": self.redis is not None,
+        }
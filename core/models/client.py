@@ -0,0 +1,109 @@
+from typing import Optional
+
+import httpx
+
+from tools.logger import config_logger
+
+# init log
+LOGGER = config_logger(
+    log_name="http_pool.log",
+    logger_name="http_pool",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+
+class HttpPool:
+    """
+    Shared, persistent HTTP connection pool for model servers.
+
+    One pool can be shared by several models so that every embedding and chat
+    request reuses kept-alive connections instead of paying TCP setup each time.
+
+    Attributes:
+        limits (httpx.Limits): Connection pool limits.
+        timeout (httpx.Timeout): Request timeouts.
+
+    Methods:
+        client -> httpx.Client:
+            The shared synchronous client, created on first use.
+
+        aclient -> httpx.AsyncClient:
+            The shared asynchronous client, created on first use.
+
+        close() -> None:
+            Close the synchronous client.
+
+        aclose() -> None:
+            Close both clients.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        connect_timeout: float = 10.0,
+        read_timeout: Optional[float] = None,
+        write_timeout: float = 60.0,
+        pool_timeout: float = 60.0,
+    ) -> None:
+        """
+        Initialize the pool settings, clients are created lazily.
+
+        Args:
+            max_connections (int): Maximum number of open connections. Defaults to 100.
+            max_keepalive_connections (int): Maximum number of idle kept-alive connections. Defaults to 20.
+            keepalive_expiry (float): Seconds an idle connection is kept alive. Defaults to 30.
+            connect_timeout (float): Seconds to wait for a connection. Defaults to 10.
+            read_timeout (Optional[float]): Seconds to wait for data, None waits forever (long generations). Defaults to None.
+            write_timeout (float): Seconds to wait for a request body to be sent. Defaults to 60.
+            pool_timeout (float): Seconds to wait for a free connection in the pool. Defaults to 60.
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=write_timeout,
+            pool=pool_timeout,
+        )
+        self._client: Optional[httpx.Client] = None
+        self._aclient: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.Client(limits=self.limits, timeout=self.timeout)
+            LOGGER.info(f"Create sync http client. limits = {self.limits}")
+        return self._client
+
+    @property
+    def aclient(self) -> httpx.AsyncClient:
+        if self._aclient is None or self._aclient.is_closed:
+            self._aclient = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            LOGGER.info(f"Create async http client. limits = {self.limits}")
+        return self._aclient
+
+    def close(self) -> None:
+        """
+        Close the synchronous client.
+        """
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+            LOGGER.info("Closed sync http client.")
+
+    async def aclose(self) -> None:
+        """
+        Close both clients.
+        """
+        self.close()
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+            LOGGER.info("Closed async http client.")
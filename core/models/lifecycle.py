@@ -0,0 +1,151 @@
+import asyncio
+import os
+import time
+import uuid
+from typing import Optional
+
+from tools.logger import config_logger
+from tools.metrics import timer
+from tools.redis_handler import RedisNotifier
+
+from .ollama import Llama31Model
+
+# init log
+LOGGER = config_logger(
+    log_name="lifecycle.log",
+    logger_name="lifecycle",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+
+class ModelLifecycle:
+    """
+    Load the generation model when the service starts and release it after an idle period.
+
+    Warming at startup moves the cold model load out of the first user request.
+    Between requests Ollama keeps the model for the `keep_alive` of the model;
+    with `idle_release`, a watcher releases it once no request came for that many
+    seconds, and the next request loads it again. With a Redis connection the
+    workers of the service share the time of their last request, so a worker
+    does not release the model while another one is still using it.
+
+    Attributes:
+        model (Llama31Model): The managed model.
+        idle_release (Optional[float]): Seconds without request before the model is released, None never releases.
+        check_interval (float): Seconds between two idle checks.
+
+    Methods:
+        astart(warm: bool = True) -> None:
+            Warm the model and start the idle watcher.
+
+        astop() -> None:
+            Stop the idle watcher.
+
+        status() -> dict:
+            State and cold/warm latency of the model.
+    """
+
+    def __init__(
+        self,
+        model: Llama31Model,
+        idle_release: Optional[float] = None,
+        check_interval: float = 30.0,
+        redis: Optional[RedisNotifier] = None,
+    ) -> None:
+        """
+        Initialize the ModelLifecycle.
+
+        Args:
+            model (Llama31Model): The managed model.
+            idle_release (Optional[float]): Seconds without request before the model is released. Defaults to None, never.
+            check_interval (float): Seconds between two idle checks. Defaults to 30.
+            redis (Optional[RedisNotifier]): Redis connection sharing the last request time across workers.
+        """
+        if idle_release is not None and idle_release <= 0:
+            raise ValueError("idle_release must be greater than 0!")
+        self.model = model
+        self.idle_release = idle_release
+        self.check_interval = check_interval
+        self.redis = redis
+        self.redis_key = f"model_last_used:{model.model_name}"
+        self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.warm_up_s: Optional[float] = None
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def astart(self, warm: bool = True) -> None:
+        """
+        Warm the model and start the idle watcher, a failed warm up only logs an error.
+
+        Args:
+            warm (bool): Load the model now, else the first request loads it. Defaults to True.
+        """
+        if warm:
+            await self._awarm()
+        if self.idle_release is not None and self._watcher is None:
+            self._watcher = asyncio.get_running_loop().create_task(self._watch())
+
+    async def _awarm(self) -> None:
+        start = time.perf_counter()
+        try:
+            load_s = await asyncio.to_thread(self.model._load_model)
+        except Exception as e:
+            # the first request loads the model instead
+            LOGGER.error(f"Can not warm {self.model.model_name}: {e}")
+            return
+        self.warm_up_s = time.perf_counter() - start
+        LOGGER.info(
+            f"Warm {self.model.model_name} in {self.warm_up_s:.2f}s (load {load_s:.2f}s), "
+            f"keep_alive={self.model.keep_alive}, idle_release={self.idle_release}."
+        )
+
+    async def astop(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+
+    def idle_time(self) -> float:
+        return time.monotonic() - self.model.last_used
+
+    def _shared_idle_time(self) -> float:
+        if self.redis is None:
+            return self.idle_time()
+        last_used = time.time() - self.idle_time()
+        pipeline = self.redis.cursor.pipeline()
+        pipeline.hset(self.redis_key, self._worker_id, last_used)
+        pipeline.expire(self.redis_key, int(self.idle_release + 2 * self.check_interval))
+        pipeline.hvals(self.redis_key)
+        with timer("redis"):
+            values = pipeline.execute()[-1]
+        last_used = max(float(value) for value in values)
+        return time.time() - last_used
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            if not self.model.loaded:
+                continue
+            try:
+                idle = await asyncio.to_thread(self._shared_idle_time)
+            except Exception as e:
+                LOGGER.error(f"Can not share the idle time of {self.model.model_name}: {e}")
+                idle = self.idle_time()
+            if idle < self.idle_release:
+                continue
+            LOGGER.info(f"{self.model.model_name} idle for {idle:.0f}s, release it.")
+            try:
+                await asyncio.to_thread(self.model._release_model)
+            except Exception as e:
+                LOGGER.error(f"Can not release {self.model.model_name}: {e}")
+
+    def status(self) -> dict:
+        return {
+            "model": self.model.model_name,
+            "loaded": self.model.loaded,
+            "keep_alive": self.model.keep_alive,
+            "idle_release": self.idle_release,
+            "idle_s": round(self.idle_time(), 1),
+            "warm_up_s": self.warm_up_s,
+            "timings": self.model.timing_stats(),
+        }
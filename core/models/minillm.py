@@ -1,11 +1,12 @@
-from typing import List, Optional
+from typing import List, Optional, Union
 
-import httpx
 from llama_index.core.base.embeddings.base import BaseEmbedding
 from pydantic import PrivateAttr
 
 from tools.logger import config_logger
 
+from .cache import EmbeddingCache
+from .client import HttpPool
 from .pattern import TextEmbedding
 
 # init log
@@ -20,12 +21,16 @@ LOGGER = config_logger(
 
 class MinillmModel(BaseEmbedding, TextEmbedding):
     _ollama_url: str = PrivateAttr()
+    _pool: HttpPool = PrivateAttr()
+    _cache: Optional[EmbeddingCache] = PrivateAttr()
 
     def __init__(
         self,
         model_name: str = "all-minilm:latest",
         host: str = "127.0.0.1",
         port: int = 11434,
+        pool: Optional[HttpPool] = None,
+        cache: Optional[EmbeddingCache] = None,
     ):
         super().__init__(
             model_name=model_name,
@@ -34,13 +39,23 @@ class MinillmModel(BaseEmbedding, TextEmbedding):
         TextEmbedding.__init__(self, model_name=model_name)
         self.model_name = model_name
         self._ollama_url = f"http://{host}:{str(port)}/api/"
+        self._pool = pool if pool is not None else HttpPool()
+        self._cache = cache
 
         self._pull_model()
 
+    @property
+    def pool(self) -> HttpPool:
+        return self._pool
+
+    @property
+    def cache(self) -> Optional[EmbeddingCache]:
+        return self._cache
+
     def _pull_model(self):
         data = {"name": self.model_name}
 
-        with httpx.stream(
+        with self._pool.client.stream(
             "POST", url=self._ollama_url + "pull", json=data, timeout=None
         ) as response:
             if (
@@ -54,10 +69,9 @@ class MinillmModel(BaseEmbedding, TextEmbedding):
 
     def _load_model(self):
         data = {"model": self.model_name, "keep_alive": -1}
-        with httpx.Client() as client:
-            response = client.post(
-                url=self._ollama_url + "embeddings", json=data, timeout=None
-            )
+        response = self._pool.client.post(
+            url=self._ollama_url + "embeddings", json=data, timeout=None
+        )
 
         if response.status_code != 200:
             LOGGER.error(f"{self.model_name} can not loaded!")
@@ -66,10 +80,9 @@ class MinillmModel(BaseEmbedding, TextEmbedding):
 
     def _release_model(self):
         data = {"model": self.model_name, "keep_alive": 0}
-        with httpx.Client() as client:
-            response = client.post(
-                url=self._ollama_url + "embeddings", json=data, timeout=None
-            )
+        response = self._pool.client.post(
+            url=self._ollama_url + "embeddings", json=data, timeout=None
+        )
 
         if response.status_code != 200:
             LOGGER.error(f"{self.model_name} can not released!")
@@ -86,6 +99,31 @@ class MinillmModel(BaseEmbedding, TextEmbedding):
     ) -> List[List[float]]:
         return self.run(data=sentences)
 
+    async def _aembed(
+        self,
+        sentences: List[str],
+        prompt_name: Optional[str] = None,
+    ) -> List[List[float]]:
+        return await self.arun(data=sentences)
+
+    def _cached_embed(self, text: str, prompt_name: str) -> List[float]:
+        if self._cache is None:
+            return self._embed(text, prompt_name=prompt_name)
+        vector = self._cache.get(model_name=self.model_name, text=text)
+        if vector is None:
+            vector = self._embed(text, prompt_name=prompt_name)
+            self._cache.set(model_name=self.model_name, text=text, vector=vector)
+        return vector
+
+    async def _acached_embed(self, text: str, prompt_name: str) -> List[float]:
+        if self._cache is None:
+            return await self._aembed(text, prompt_name=prompt_name)
+        vector = await self._cache.aget(model_name=self.model_name, text=text)
+        if vector is None:
+            vector = await self._aembed(text, prompt_name=prompt_name)
+            await self._cache.aset(model_name=self.model_name, text=text, vector=vector)
+        return vector
+
     def _get_query_embedding(self, query: str) -> List[float]:
         """Generates Embeddings for Query.
 
@@ -95,7 +133,7 @@ class MinillmModel(BaseEmbedding, TextEmbedding):
         Returns:
             List[float]: numpy array of embeddings
         """
-        return self._embed(query, prompt_name="query")
+        return self._cached_embed(query, prompt_name="query")
 
     async def _aget_query_embedding(self, query: str) -> List[float]:
         """Generates Embeddings for Query Asynchronously.
@@ -106,7 +144,7 @@ class MinillmModel(BaseEmbedding, TextEmbedding):
         Returns:
             List[float]: numpy array of embeddings
         """
-        return self._get_query_embedding(query)
+        return await self._acached_embed(query, prompt_name="query")
 
     async def _aget_text_embedding(self, text: str) -> List[float]:
         """Generates Embeddings for text Asynchronously.
@@ -117,7 +155,18 @@ class MinillmModel(BaseEmbedding, TextEmbedding):
         Returns:
             List[float]: numpy array of embeddings
         """
-        return self._get_text_embedding(text)
+        return await self._acached_embed(text, prompt_name="text")
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Generates Embeddings for texts Asynchronously.
+
+        Args:
+            texts (List[str]): Texts / Sentences
+
+        Returns:
+            List[List[float]]: numpy array of embeddings
+        """
+        return await self._aembed(texts, prompt_name="text")
 
     def _get_text_embedding(self, text: str) -> List[float]:
         """Generates Embeddings for text.
@@ -128,7 +177,7 @@ class MinillmModel(BaseEmbedding, TextEmbedding):
         Returns:
             List[float]: numpy array of embeddings
         """
-        return self._embed(text, prompt_name="text")
+        return self._cached_embed(text, prompt_name="text")
 
     def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
         """Generates Embeddings for text.
@@ -141,18 +190,49 @@ class MinillmModel(BaseEmbedding, TextEmbedding):
         """
         return self._embed(texts, prompt_name="text")
 
-    def run(self, data: str) -> list:
+    def _parse_embeddings(self, data: Union[str, List[str]], response) -> list:
+        if response.status_code != 200:
+            LOGGER.error(f"{self.model_name} embed failed! status = {response.status_code}")
+            raise RuntimeError(response.text)
+
+        embeddings = response.json()["embeddings"]
+        if isinstance(data, str):
+            return embeddings[0]
+        return embeddings
+
+    def run(self, data: Union[str, List[str]]) -> list:
+        """
+        Generate embeddings through the Ollama `/api/embed` endpoint.
+
+        Args:
+            data (Union[str, List[str]]): A single text or a batch of texts.
+
+        Returns:
+            list: The embedding vector for a single text, or one vector per text for a batch.
+        """
         request_data = {"model": self.model_name, "input": data}
 
-        with httpx.Client() as client:
-            response = client.post(
-                url=self._ollama_url + "embed", json=request_data, timeout=None
-            )
+        response = self._pool.client.post(
+            url=self._ollama_url + "embed", json=request_data
+        )
+        return self._parse_embeddings(data=data, response=response)
+
+    async def arun(self, data: Union[str, List[str]]) -> list:
+        """
+        Generate embeddings through the Ollama `/api/embed` endpoint without blocking the event loop.
 
-        if response.status_code == 200:
-            content = response.json()
-            result = content["embeddings"][0]
-        return result
+        Args:
+            data (Union[str, List[str]]): A single text or a batch of texts.
+
+        Returns:
+            list: The embedding vector for a single text, or one vector per text for a batch.
+        """
+        request_data = {"model": self.model_name, "input": data}
+
+        response = await self._pool.aclient.post(
+            url=self._ollama_url + "embed", json=request_data
+        )
+        return self._parse_embeddings(data=data, response=response)
 
 
 if __name__ == "__main__":
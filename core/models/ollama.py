@@ -1,13 +1,17 @@
+import asyncio
 import json
-from collections.abc import Generator
+import time
+from collections.abc import AsyncGenerator, Generator
+from typing import Optional, Union
 
-import httpx
 import llama_index.core.instrumentation as instrument
 from opentelemetry import trace
 
 from tools.logger import config_logger
 from tools.redis_handler import RedisNotifier
+from tools.trace_context import get_request_id, set_span_id
 
+from .client import HttpPool
 from .pattern import Text2Text
 
 dispatcher = instrument.get_dispatcher(__name__)
@@ -22,23 +26,62 @@ LOGGER = config_logger(
 
 
 class Llama31Model(Text2Text):
+    """
+    Llama 3.1 served by Ollama through the /api/chat endpoint.
+
+    Every request sends `keep_alive`, so Ollama keeps the model in memory between
+    bursts of requests. The timings Ollama reports at the end of a generation are
+    logged, a generation whose model load took at least `cold_threshold` seconds
+    counts as a cold start.
+
+    Attributes:
+        model_name (str): Name of the Ollama model.
+        keep_alive (Optional[Union[str, int]]): How long Ollama keeps the model loaded after a request, e.g. "30m", -1 forever, None leaves the Ollama default.
+        last_used (float): time.monotonic() of the last request.
+        loaded (bool): Whether the model is believed to be in memory.
+
+    Methods:
+        run(prompt: list, max_tokens: int = 350, notify_span: bool = True) -> Generator[str]:
+            Generate the answer token by token.
+
+        arun(prompt: list, max_tokens: int = 350, notify_span: bool = True) -> AsyncGenerator[str]:
+            Generate the answer token by token without blocking the event loop.
+
+        timing_stats() -> dict:
+            Count and mean latency of cold and warm generations.
+    """
+
     def __init__(
         self,
         model_name: str = "llama3.1",
         host: str = "localhost",
         port: int = 11434,
         redis: RedisNotifier = None,
+        pool: Optional[HttpPool] = None,
+        span_ttl: int = 600,
+        keep_alive: Optional[Union[str, int]] = "30m",
+        cold_threshold: float = 1.0,
     ) -> None:
         super().__init__(model_name)
         self.model_name = model_name
         self.ollama_url = f"http://{host}:{str(port)}/api/"
         self.redis = redis
+        self.span_ttl = span_ttl
+        self.pool = pool if pool is not None else HttpPool()
+        self.keep_alive = keep_alive
+        self.cold_threshold = cold_threshold
+        self.last_used = time.monotonic()
+        self.loaded = False
+        self._timings = {
+            state: {"count": 0, "load_s": 0.0, "prompt_eval_s": 0.0, "total_s": 0.0}
+            for state in ("cold", "warm")
+        }
         # self._pull_model()
 
     def _pull_model(self):
         data = {"name": self.model_name}
 
-        with httpx.stream(
+        with self.pool.client.stream(
             "POST", url=self.ollama_url + "pull", json=data, timeout=None
         ) as response:
             if (
@@ -50,58 +93,185 @@ class Llama31Model(Text2Text):
                 for chunk in response.iter_lines():
                     LOGGER.info(chunk)
 
-    def _load_model(self):
-        data = {"model": self.model_name, "keep_alive": -1}
-        with httpx.Client() as client:
-            response = client.post(
-                url=self.ollama_url + "generate", json=data, timeout=None
-            )
+    def _load_model(self) -> float:
+        """
+        Load the model into memory, an empty generation only loads it.
+
+        Returns:
+            float: Seconds Ollama spent loading the model, close to 0 when it was already loaded.
+        """
+        data = {
+            "model": self.model_name,
+            "keep_alive": -1 if self.keep_alive is None else self.keep_alive,
+        }
+        response = self.pool.client.post(
+            url=self.ollama_url + "generate", json=data, timeout=None
+        )
 
         if response.status_code != 200:
             LOGGER.error(f"{self.model_name} can not loaded!")
             raise RuntimeError
-        LOGGER.info(f"Success init {self.model_name}!")
+        self.loaded = True
+        self.last_used = time.monotonic()
+        load_s = response.json().get("load_duration", 0) / 1e9
+        LOGGER.info(f"Success init {self.model_name}! load time: {load_s:.2f}s")
+        return load_s
 
     def _release_model(self):
         data = {"model": self.model_name, "keep_alive": 0}
-        with httpx.Client() as client:
-            response = client.post(
-                url=self.ollama_url + "generate", json=data, timeout=None
-            )
+        response = self.pool.client.post(
+            url=self.ollama_url + "generate", json=data, timeout=None
+        )
 
         if response.status_code != 200:
             LOGGER.error(f"{self.model_name} can not released!")
+            return
+        self.loaded = False
         LOGGER.info(f"Success release {self.model_name}!")
 
+    def _record_timings(self, chunk: dict) -> None:
+        """
+        Log the timings of a finished generation, reported by Ollama in nanoseconds.
+
+        Args:
+            chunk (dict): The last chunk of the stream, with "done" set.
+        """
+        load_s = chunk.get("load_duration", 0) / 1e9
+        prompt_eval_s = chunk.get("prompt_eval_duration", 0) / 1e9
+        total_s = chunk.get("total_duration", 0) / 1e9
+        state = "cold" if load_s >= self.cold_threshold else "warm"
+        stats = self._timings[state]
+        stats["count"] += 1
+        stats["load_s"] += load_s
+        stats["prompt_eval_s"] += prompt_eval_s
+        stats["total_s"] += total_s
+        self.loaded = True
+        LOGGER.info(
+            f"{state} generation: load {load_s:.3f}s, prompt eval "
+            f"{chunk.get('prompt_eval_count', 0)} tokens in {prompt_eval_s:.3f}s, "
+            f"eval {chunk.get('eval_count', 0)} tokens in {chunk.get('eval_duration', 0) / 1e9:.3f}s, "
+            f"total {total_s:.3f}s."
+        )
+
+    def timing_stats(self) -> dict:
+        return {
+            state: {
+                "count": stats["count"],
+                **{
+                    f"mean_{name}": stats[name] / stats["count"] if stats["count"] else 0.0
+                    for name in ("load_s", "prompt_eval_s", "total_s")
+                },
+            }
+            for state, stats in self._timings.items()
+        }
+
+    def _content(self, line: str) -> str:
+        chunk = json.loads(line)
+        if chunk.get("done"):
+            self._record_timings(chunk)
+        return chunk.get("message", {}).get("content", "")
+
     def chat_stream(self, request_data: dict) -> Generator[str]:
         try:
-            with httpx.stream(
-                "POST", url=self.ollama_url + "chat", json=request_data, timeout=None
+            with self.pool.client.stream(
+                "POST", url=self.ollama_url + "chat", json=request_data
             ) as response:
                 if response.headers.get("Transfer-Encoding") == "chunked":
                     for chunk in response.iter_lines():
-                        yield json.loads(chunk)["message"]["content"]
+                        content = self._content(chunk)
+                        if content:
+                            yield content
                 else:
                     raise RuntimeError(json.loads(response.read().decode("utf-8")))
         except BaseException as e:
             yield f"Error occurred: {str(e)}\n\n"
 
-    @dispatcher.span
-    def run(self, prompt: list, max_tokens: int = 350) -> Generator[str]:
+    async def achat_stream(self, request_data: dict) -> AsyncGenerator[str]:
+        try:
+            async with self.pool.aclient.stream(
+                "POST", url=self.ollama_url + "chat", json=request_data
+            ) as response:
+                if response.headers.get("Transfer-Encoding") == "chunked":
+                    async for chunk in response.aiter_lines():
+                        content = self._content(chunk)
+                        if content:
+                            yield content
+                else:
+                    raise RuntimeError(json.loads((await response.aread()).decode("utf-8")))
+        except Exception as e:
+            yield f"Error occurred: {str(e)}\n\n"
+
+    def _request_data(self, prompt: list, max_tokens: int) -> dict:
         LOGGER.info(
             f"Input: {[entry['content'] for entry in prompt if entry['role'] == 'user']}"
         )
-        request_data = {
+        self.last_used = time.monotonic()
+        data = {
             "model": self.model_name,
             "messages": prompt,
             "options": {"num_predict": max_tokens},
         }
-        yield from self.chat_stream(request_data=request_data)
-        # LOGGER.info(f"Output :{result} , type:{type(result)}")
+        if self.keep_alive is not None:
+            data["keep_alive"] = self.keep_alive
+        return data
+
+    def _span_id(self) -> str:
+        """
+        Set the span id of this generation on the caller's request context.
+
+        Returns:
+            str: The span id.
+        """
         current_span = trace.get_current_span()
         span_id = current_span.get_span_context().span_id.to_bytes(8, "big").hex()
-        if self.redis:
-            self.redis.send(span_id)
+        set_span_id(span_id)
+        return span_id
+
+    def _save_span(self, span_id: str, request_id: str) -> None:
+        self.redis.send(
+            span_id,
+            key=f"{self.redis.keyword}:{request_id}",
+            expire=self.span_ttl,
+        )
+
+    def _notify_span(self) -> None:
+        """
+        Hand the span id of this generation back to the caller's request context.
+
+        With a redis connection the span id is also saved under a per-request key
+        "<keyword>:<request id>" which expires after `span_ttl` seconds.
+        """
+        span_id = self._span_id()
+        request_id = get_request_id()
+        if self.redis and request_id:
+            self._save_span(span_id=span_id, request_id=request_id)
+
+    async def _anotify_span(self) -> None:
+        # the context variable is set here, only the Redis write goes to a thread
+        span_id = self._span_id()
+        request_id = get_request_id()
+        if self.redis and request_id:
+            await asyncio.to_thread(self._save_span, span_id, request_id)
+
+    @dispatcher.span
+    def run(
+        self, prompt: list, max_tokens: int = 350, notify_span: bool = True
+    ) -> Generator[str]:
+        request_data = self._request_data(prompt=prompt, max_tokens=max_tokens)
+        yield from self.chat_stream(request_data=request_data)
+        # LOGGER.info(f"Output :{result} , type:{type(result)}")
+        if notify_span:
+            self._notify_span()
+
+    @dispatcher.span
+    async def arun(
+        self, prompt: list, max_tokens: int = 350, notify_span: bool = True
+    ) -> AsyncGenerator[str]:
+        request_data = self._request_data(prompt=prompt, max_tokens=max_tokens)
+        async for data in self.achat_stream(request_data=request_data):
+            yield data
+        if notify_span:
+            await self._anotify_span()
 
 
 if __name__ == "__main__":
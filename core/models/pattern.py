@@ -86,3 +86,15 @@ class TopicsClassification(Model):
 
     def __init__(self, model_name: str) -> None:
         super().__init__(model_name)
+
+
+class Reranker(Model):
+    """Reranker Model.
+
+    This class represents a reranker model, which scores the relevance of
+    candidate passages to a query so that only the best ones are kept.
+
+    """
+
+    def __init__(self, model_name: str) -> None:
+        super().__init__(model_name)
@@ -0,0 +1,150 @@
+import asyncio
+import re
+from typing import List, Optional
+
+from tools.logger import config_logger
+
+from .client import HttpPool
+from .pattern import Reranker
+
+# init log
+LOGGER = config_logger(
+    log_name="reranker.log",
+    logger_name="reranker",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+
+class CrossEncoderReranker(Reranker):
+    """
+    Cross-encoder reranker running on CPU with sentence-transformers.
+
+    Attributes:
+        model_name (str): HuggingFace name of the cross-encoder.
+        batch_size (int): Number of (query, passage) pairs scored per forward pass.
+
+    Methods:
+        score(query: str, texts: List[str]) -> List[float]:
+            Score the relevance of every text to the query.
+
+        ascore(query: str, texts: List[str]) -> List[float]:
+            Score without blocking the event loop.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+        device: str = "cpu",
+        batch_size: int = 16,
+    ) -> None:
+        super().__init__(model_name)
+        self.device = device
+        self.batch_size = batch_size
+        self.model = self._load_model(model_name)
+
+    def _load_model(self, model_name: str):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError(
+                "The cross-encoder reranker needs sentence-transformers, `pip install sentence-transformers`."
+            ) from e
+        model = CrossEncoder(model_name, device=self.device)
+        LOGGER.info(f"Success init {model_name} on {self.device}!")
+        return model
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        if not texts:
+            return []
+        scores = self.model.predict(
+            [(query, text) for text in texts],
+            batch_size=self.batch_size,
+            show_progress_bar=False,
+        )
+        return [float(score) for score in scores]
+
+    async def ascore(self, query: str, texts: List[str]) -> List[float]:
+        return await asyncio.to_thread(self.score, query, texts)
+
+
+class OllamaReranker(Reranker):
+    """
+    Reranker which asks an Ollama model to grade the relevance of every passage from 0 to 10.
+
+    Needs no extra dependency; the passages are graded concurrently, at most
+    `max_concurrency` requests at a time.
+
+    Attributes:
+        model_name (str): Name of the Ollama model.
+        max_concurrency (int): Maximum number of grading requests in flight.
+
+    Methods:
+        score(query: str, texts: List[str]) -> List[float]:
+            Score the relevance of every text to the query.
+
+        ascore(query: str, texts: List[str]) -> List[float]:
+            Score concurrently without blocking the event loop.
+    """
+
+    prompt = (
+        "Grade how relevant the passage is to the question, from 0 (unrelated) to 10 "
+        "(answers it). Reply with the number only.\n\n"
+        "Question: {query}\n\nPassage: {text}\n\nGrade:"
+    )
+
+    def __init__(
+        self,
+        model_name: str = "llama3.1",
+        host: str = "localhost",
+        port: int = 11434,
+        pool: Optional[HttpPool] = None,
+        max_concurrency: int = 4,
+    ) -> None:
+        super().__init__(model_name)
+        self.ollama_url = f"http://{host}:{str(port)}/api/"
+        self.pool = pool if pool is not None else HttpPool()
+        self.max_concurrency = max_concurrency
+
+    def _load_model(self, model_name: str):
+        # served by Ollama, nothing to load in this process
+        return None
+
+    def _request_data(self, query: str, text: str) -> dict:
+        return {
+            "model": self.model_name,
+            "prompt": self.prompt.format(query=query, text=text),
+            "stream": False,
+            "options": {"temperature": 0, "num_predict": 3},
+        }
+
+    @staticmethod
+    def _parse_score(response) -> float:
+        if response.status_code != 200:
+            LOGGER.error(f"Grading failed: {response.status_code}, {response.text}")
+            return 0.0
+        match = re.search(r"\d+(?:\.\d+)?", response.json().get("response", ""))
+        return min(float(match.group()), 10.0) if match else 0.0
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        return [
+            self._parse_score(
+                self.pool.client.post(
+                    url=self.ollama_url + "generate", json=self._request_data(query, text)
+                )
+            )
+            for text in texts
+        ]
+
+    async def ascore(self, query: str, texts: List[str]) -> List[float]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def grade(text: str) -> float:
+            async with semaphore:
+                response = await self.pool.aclient.post(
+                    url=self.ollama_url + "generate", json=self._request_data(query, text)
+                )
+            return self._parse_score(response)
+
+        return list(await asyncio.gather(*(grade(text) for text in texts)))
@@ -1,8 +1,14 @@
-from typing import List, Union
+import re
+import time
+from typing import List, Optional, Union
 
-from jinja2 import Template
+from llama_index.core.schema import NodeWithScore
 
 from tools.logger import config_logger
+from tools.metrics import observe, timer
+from tools.tokenizer import TokenCounter
+
+from .registry import TemplateRegistry
 
 # init log
 LOGGER = config_logger(
@@ -25,7 +31,9 @@ class PromptEngineerService:
     conversation history summarization and generating answers to user questions.
 
     Methods:
-        
+        assemble_context(nodes: List[NodeWithScore]) -> str:
+            Build the retrieval context of the prompt within the token budget.
+
         generate(
             retrieval: Union[str, bool],
             prompt: str,
@@ -34,34 +42,122 @@ class PromptEngineerService:
             Generate a prompt based on conversation history, retrieval information, and user question.
     """
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        context_budget: int = 1500,
+        tokenizer: Optional[str] = None,
+        min_chunk_tokens: int = 32,
+        duplicate_threshold: float = 0.8,
+        registry: Optional[TemplateRegistry] = None,
+        template_version: Optional[str] = None,
+        system_template: Optional[str] = "chat_system",
+    ) -> None:
         """
         Initialize the Service with a chat prompt builder and predefined templates.
+
+        Args:
+            context_budget (int): Maximum number of tokens of the retrieval context. Defaults to 1500.
+            tokenizer (Optional[str]): HuggingFace tokenizer of the generation model, None estimates the tokens.
+            min_chunk_tokens (int): A chunk cut by the budget is kept only if this many tokens still fit. Defaults to 32.
+            duplicate_threshold (float): Word 5-gram overlap above which a chunk is a duplicate of a kept one. Defaults to 0.8.
+            registry (Optional[TemplateRegistry]): Registry of the prompt templates, None loads the shipped templates.
+            template_version (Optional[str]): Version of the "chat" template, None uses the latest.
+            system_template (Optional[str]): Template of the fixed system message opening every prompt, None sends none.
         """
         # self.builder = PromptTemplate()
+        self.context_budget = context_budget
+        self.min_chunk_tokens = min_chunk_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.token_counter = TokenCounter(tokenizer=tokenizer)
+        self.separator = "\n\n---\n\n"
+        self.registry = registry if registry is not None else TemplateRegistry()
+        self.template_version = template_version
+        self.system_template = system_template
+        # compile now, not on the first chat
+        self.registry.get("chat", version=template_version)
+        if system_template:
+            self.registry.get(system_template)
 
-        self.template = {
-            "chat": """
-If you are not sure about the answer or do not have enough information, please answer "i don't know." 
+        LOGGER.info("Success init prompt !")
 
-## Context Information
+    @staticmethod
+    def _shingles(text: str, size: int = 5) -> set:
+        words = text.lower().split()
+        return {tuple(words[i : i + size]) for i in range(max(1, len(words) - size + 1))}
 
-{% if retriever_info %}
-Retriever's Information:
-{{ retriever_info }}
-{% endif %}
+    def _is_duplicate(self, text: str, shingles: set, kept: List[tuple]) -> bool:
+        for kept_text, kept_shingles in kept:
+            if text in kept_text:
+                return True
+            overlap = len(shingles & kept_shingles) / max(1, min(len(shingles), len(kept_shingles)))
+            if overlap >= self.duplicate_threshold:
+                return True
+        return False
 
-## Question and Answer
+    @dispatcher.span
+    def assemble_context(self, nodes: List[NodeWithScore]) -> str:
+        """
+        Build the retrieval context of the prompt within the token budget.
 
-Question: {{ question }}
+        Chunks are taken by descending score, near-duplicates of an already taken
+        chunk are skipped and the chunk reaching the budget is truncated (or dropped
+        when less than `min_chunk_tokens` are left).
+
+        Args:
+            nodes (List[NodeWithScore]): The retrieved nodes.
+
+        Returns:
+            str: The chunks joined by a separator.
+        """
+        start = time.perf_counter()
+        ranked = sorted(
+            nodes,
+            key=lambda node: node.score if node.score is not None else float("-inf"),
+            reverse=True,
+        )
+        separator_tokens = self.token_counter.count(self.separator)
+        kept, chunks = [], []
+        used = dropped = duplicates = dropped_chunks = 0
+        for node in ranked:
+            text = re.sub(r"[ \t]+", " ", node.node.get_content()).strip()
+            if not text:
+                continue
+            shingles = self._shingles(text)
+            if self._is_duplicate(text, shingles, kept):
+                duplicates += 1
+                continue
+            tokens = self.token_counter.count(text)
+            left = self.context_budget - used - (separator_tokens if chunks else 0)
+            if tokens > left:
+                if left < self.min_chunk_tokens:
+                    dropped += tokens
+                    dropped_chunks += 1
+                    continue
+                text = self.token_counter.truncate(text, left)
+                truncated = self.token_counter.count(text)
+                dropped += tokens - truncated
+                tokens = truncated
+            kept.append((text, shingles))
+            chunks.append(text)
+            used += tokens + (separator_tokens if len(chunks) > 1 else 0)
+        LOGGER.info(
+            f"Context: {used}/{self.context_budget} tokens used, {dropped} tokens dropped "
+            f"({len(chunks)} chunks kept, {duplicates} duplicates, {dropped_chunks} chunks over budget, "
+            f"tokenizer={self.token_counter.name})."
+        )
+        observe("context_assembly", time.perf_counter() - start)
+        return self.separator.join(chunks)
 
-Answer:
-"""}
-        LOGGER.info("Success init prompt !")
     def _package(self,retrieval: Union[str, bool],
         prompt: str,
-        instruction: Union[list, None] = None,):
+        instruction: Union[list, None] = None,
+        history: Optional[List[dict]] = None,):
         prompt_package = []
+        # the same first message in every prompt, so Ollama reuses its cached prefix
+        if self.system_template:
+            prompt_package.append(
+                {"role": "system", "content": self.registry.render(self.system_template)}
+            )
         if instruction:
             if isinstance(instruction,list):
                 for command in instruction:
@@ -74,18 +170,23 @@ Answer:
 
         # if retrieval:
         #     prompt_package.append({"role": "assistant", "content": retrieval})
-        
+
+        # earlier conversation goes between the instructions and the new question
+        if history:
+            prompt_package.extend(history)
+
         if prompt:
             prompt_package.append({"role": "user", "content": prompt})
-        
+
         return prompt_package
-    
+
     @dispatcher.span
     def generate(
         self,
         retrieval: Union[str, bool],
         question: str,
         instruction: Union[list, None] = None,
+        history: Optional[List[dict]] = None,
     ) -> str:
         """
         Generate a prompt based on conversation history, retrieval information, and user question.
@@ -94,16 +195,21 @@ Answer:
             retrieval (Union[str, bool]): Information retrieved from a database.
             question (str): User question.
             instruction (Union[List[str], None], optional): System instructions. Defaults to None.
+            history (Optional[List[dict]]): Chat messages of the earlier conversation, e.g. from ConversationMemoryService. Defaults to None.
 
         Returns:
             str: The generated prompt for answering the user question.
         """
-        template = Template(self.template["chat"])
-        prompt = template.render(
-            retriever_info=retrieval,
-            question=question,
-        )
-        prompt = self._package(retrieval=retrieval,prompt=prompt,instruction=instruction)
+        with timer("prompt_render"):
+            prompt = self.registry.render(
+                "chat",
+                version=self.template_version,
+                retriever_info=retrieval,
+                question=question,
+            )
+            prompt = self._package(
+                retrieval=retrieval, prompt=prompt, instruction=instruction, history=history
+            )
         return prompt
 
 
@@ -0,0 +1,161 @@
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+from jinja2 import Environment, FileSystemLoader, Template
+
+from tools.logger import config_logger
+
+# init log
+LOGGER = config_logger(
+    log_name="prompt_registry.log",
+    logger_name="prompt_registry",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+TEMPLATE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+TEMPLATE_SUFFIX = ".j2"
+
+
+def _version_key(version: str) -> list:
+    # natural order, so that "v10" comes after "v9"
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", version)]
+
+
+class TemplateRegistry:
+    """
+    Registry of named, versioned Jinja templates loaded from files.
+
+    A template "chat" in version "v1" is the file `<folder>/chat/v1.j2`. Every template
+    is compiled once; with `auto_reload`, a template whose file changed is recompiled
+    on its next use, so prompts can be edited without restarting the service.
+
+    Attributes:
+        folder (str): Folder of the template files.
+        environment (Environment): The Jinja environment caching the compiled templates.
+
+    Methods:
+        versions(name: str) -> List[str]:
+            Available versions of a template, oldest first.
+
+        get(name: str, version: Optional[str] = None) -> Template:
+            Get a compiled template.
+
+        source(name: str, version: Optional[str] = None) -> str:
+            Get the source of a template.
+
+        render(name: str, version: Optional[str] = None, **context) -> str:
+            Render a template, recording the render time.
+
+        stats() -> dict:
+            Render count and time per template.
+    """
+
+    def __init__(
+        self,
+        folder: str = TEMPLATE_FOLDER,
+        auto_reload: bool = True,
+        default_versions: Optional[Dict[str, str]] = None,
+    ) -> None:
+        """
+        Initialize the TemplateRegistry.
+
+        Args:
+            folder (str): Folder of the template files. Defaults to the templates shipped with core.prompt.
+            auto_reload (bool): Recompile templates whose file changed. Defaults to True.
+            default_versions (Optional[Dict[str, str]]): Version used per template name when none is given, the latest otherwise.
+        """
+        self.folder = folder
+        self.default_versions = dict(default_versions or {})
+        self.environment = Environment(
+            loader=FileSystemLoader(folder),
+            auto_reload=auto_reload,
+        )
+        self._sources: Dict[str, tuple] = {}
+        self._stats: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        LOGGER.info(f"Load prompt templates from '{folder}', auto_reload={auto_reload}.")
+
+    def versions(self, name: str) -> List[str]:
+        folder = os.path.join(self.folder, name)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(
+            (
+                file[: -len(TEMPLATE_SUFFIX)]
+                for file in os.listdir(folder)
+                if file.endswith(TEMPLATE_SUFFIX)
+            ),
+            key=_version_key,
+        )
+
+    def _path(self, name: str, version: Optional[str]) -> str:
+        version = version or self.default_versions.get(name)
+        if version is None:
+            versions = self.versions(name)
+            if not versions:
+                raise ValueError(f"No template '{name}' in '{self.folder}'!")
+            # pin the latest version, so that a reload does not list the folder again
+            version = self.default_versions.setdefault(name, versions[-1])
+        return f"{name}/{version}{TEMPLATE_SUFFIX}"
+
+    def get(self, name: str, version: Optional[str] = None) -> Template:
+        """
+        Get a compiled template, compiling it on first use or after its file changed.
+
+        Args:
+            name (str): Name of the template.
+            version (Optional[str]): Version of the template, None for the default one.
+
+        Returns:
+            Template: The compiled template.
+        """
+        return self.environment.get_template(self._path(name, version))
+
+    def source(self, name: str, version: Optional[str] = None) -> str:
+        template = self.get(name, version)
+        with self._lock:
+            cached = self._sources.get(template.name)
+            if cached is None or cached[0] is not template:
+                source, _, _ = self.environment.loader.get_source(
+                    self.environment, template.name
+                )
+                cached = self._sources[template.name] = (template, source)
+        return cached[1]
+
+    def render(self, name: str, version: Optional[str] = None, **context) -> str:
+        """
+        Render a template, recording the render time.
+
+        Args:
+            name (str): Name of the template.
+            version (Optional[str]): Version of the template, None for the default one.
+            **context: Variables of the template.
+
+        Returns:
+            str: The rendered text.
+        """
+        start = time.perf_counter()
+        template = self.get(name, version)
+        text = template.render(**context)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            stats = self._stats.setdefault(
+                template.name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+            )
+            stats["count"] += 1
+            stats["total_ms"] += elapsed * 1000
+            stats["max_ms"] = max(stats["max_ms"], elapsed * 1000)
+        LOGGER.debug(f"Render '{template.name}' in {elapsed * 1000:.3f}ms.")
+        return text
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                name: {**stats, "mean_ms": stats["total_ms"] / stats["count"]}
+                for name, stats in self._stats.items()
+            }
@@ -0,0 +1,43 @@
+import os
+import re
+from typing import List
+
+from llama_index.core.schema import BaseNode, MetadataMode
+
+# Product codes and model numbers like "EGPS-3401", "EGPU-3201" or "EMUC-B2S3":
+# a letter first, at least one hyphen and at least one digit.
+CODE_PATTERN = re.compile(r"(?<![\w-])[A-Z][A-Z0-9]*(?:-[A-Z0-9]+)+(?![\w-])")
+
+
+def extract_codes(text: str) -> List[str]:
+    """
+    Extract the product codes mentioned in a text, case-insensitively.
+
+    Args:
+        text (str): The text, e.g. a chunk, a file name or a user query.
+
+    Returns:
+        List[str]: The upper-cased codes, in order of first appearance.
+    """
+    codes = (
+        code
+        for code in CODE_PATTERN.findall(text.upper())
+        if any(c.isdigit() for c in code)
+    )
+    return list(dict.fromkeys(codes))
+
+
+def node_codes(node: BaseNode) -> List[str]:
+    """
+    Extract the product codes of a node from its file name and its text.
+
+    Args:
+        node (BaseNode): The node.
+
+    Returns:
+        List[str]: The upper-cased codes.
+    """
+    file_name = os.path.basename(str(node.metadata.get("file_name") or ""))
+    # "Innodisk_EGPS-3401_Datasheet.pdf" -> "Innodisk EGPS-3401 Datasheet"
+    stem = os.path.splitext(file_name)[0].replace("_", " ")
+    return extract_codes(f"{stem}\n{node.get_content(metadata_mode=MetadataMode.NONE)}")
@@ -1,10 +1,13 @@
+import time
+from collections.abc import Iterable, Iterator
 from pathlib import Path
-from typing import Literal
+from typing import List, Literal, Optional, Tuple
 
 from llama_index.core import SimpleDirectoryReader
 
 # from haystack.components.converters import PyPDFToDocument, TextFileToDocument
 from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import BaseNode
 
 # from llama_index.readers.smart_pdf_loader import SmartPDFLoader
 from core.models import Llama31Model
@@ -12,6 +15,7 @@ from tools.ai_markdown_reader import AI_PDFLoader
 
 # from haystack.components.preprocessors import DocumentCleaner, DocumentSplitter
 from tools.logger import config_logger
+from tools.markdown_cache import MarkdownCache
 from tools.markdown_splitter import MarkdownSplitterNodeParser
 
 # init log
@@ -36,18 +40,36 @@ class Process:
         document_splitter: Tool for splitting documents into chunks for easier processing.
 
     Methods:
-        run(data_folder: str, private: bool = False) -> list:
+        list_files(data_folder: str) -> List[str]:
+            List every file under the data folder.
+
+        run(data_folder: str, private: bool = False, input_files: Optional[List[str]] = None) -> list:
             Preprocess data for RAG, returning the document splitter and processed documents.
+
+        iter_nodes(documents: Iterable) -> Iterator[BaseNode]:
+            Split documents into nodes lazily, one document at a time.
+
+        close() -> None:
+            Stop the worker threads of the reader.
     """
 
-    def __init__(self, tools: Literal["default", "ai"] = "default") -> None:
+    def __init__(
+        self,
+        tools: Literal["default", "ai"] = "default",
+        page_workers: int = 4,
+        markdown_cache: Optional[str] = "./cache/ai_markdown.sqlite",
+    ) -> None:
         """
         Initialize the Process class for data preprocessing.
 
         Args:
             tools (Literal["default", "ai"]): Specify which set of tools to use for data preprocessing. Defaults to "default".
+            page_workers (int): Maximum number of PDF pages converted by the AI reader at the same time. Defaults to 4.
+            markdown_cache (Optional[str]): Path of the cache of the markdown generated by the AI reader, None disables it.
         """
         LOGGER.info("Init pgvector data process...")
+        self.page_workers = page_workers
+        self.markdown_cache = markdown_cache
         self._init_tools(tools)
         LOGGER.info("Success init pgvector data process...")
 
@@ -61,7 +83,12 @@ class Process:
         LOGGER.info("Initializing pdf_converter...")
         if usage_tools.lower() == "ai":
             model = Llama31Model(host="10.204.16.75")
-            self.reader = AI_PDFLoader(model=model)
+            cache = (
+                MarkdownCache(path=self.markdown_cache) if self.markdown_cache else None
+            )
+            self.reader = AI_PDFLoader(
+                model=model, max_workers=self.page_workers, cache=cache
+            )
             self.document_splitter = MarkdownSplitterNodeParser(separator="#")
         else:
             self.reader = None
@@ -90,35 +117,110 @@ class Process:
             return lambda filename: {"file_name": filename, "privacy": 0}
         return lambda filename: {"file_name": filename, "privacy": 1}
 
-    def run(self, data_folder: str, private: bool = False) -> list:
+    def list_files(self, data_folder: str) -> List[str]:
+        """
+        List every file under the data folder, in a stable order.
+
+        Args:
+            data_folder (str): The path to the data folder.
+
+        Returns:
+            List[str]: Paths of the files.
+        """
+        reader = SimpleDirectoryReader(input_dir=data_folder, recursive=True)
+        return sorted(str(path) for path in reader.input_files)
+
+    def run(
+        self,
+        data_folder: Optional[str] = None,
+        private: bool = False,
+        input_files: Optional[List[str]] = None,
+    ) -> list:
         """
         Preprocess data for RAG by reading, optionally applying privacy settings, and splitting documents.
 
         Args:
-            data_folder (str): The path to the data folder (currently only supports PDF files).
+            data_folder (Optional[str]): The path to the data folder (currently only supports PDF files).
             private (bool): Whether to apply privacy settings to the documents. Default is False.
+            input_files (Optional[List[str]]): Read only these files instead of the whole data folder.
 
         Returns:
             list: A list containing the document splitter and processed documents.
         """
 
         privacy_settings = self._private_setting(private=private)
+        source = (
+            {"input_files": input_files}
+            if input_files is not None
+            else {"input_dir": data_folder}
+        )
         if self.reader:
             docs = SimpleDirectoryReader(
-                input_dir=data_folder,
+                **source,
                 file_metadata=privacy_settings,
                 file_extractor={".pdf": self.reader},
                 recursive=True,
             ).load_data()
         else:
             docs = SimpleDirectoryReader(
-                input_dir=data_folder,
+                **source,
                 file_metadata=privacy_settings,
                 recursive=True,
             ).load_data()
 
         return self.document_splitter, docs
 
+    def iter_nodes(self, documents: Iterable) -> Iterator[BaseNode]:
+        """
+        Split documents into nodes lazily, one document (PDF page) at a time.
+
+        Only the nodes of the current document are held in memory, so the
+        consumer controls how many nodes exist at once.
+
+        Args:
+            documents (Iterable): Documents returned by `run`.
+
+        Yields:
+            BaseNode: The nodes of the documents, in order.
+        """
+        for document in documents:
+            yield from self.document_splitter.get_nodes_from_documents([document])
+
+    def close(self) -> None:
+        """
+        Stop the worker threads of the reader, they restart on the next run.
+        """
+        if self.reader is not None:
+            self.reader.close()
+
+
+# Process of a worker of the multiprocess ingestion, created on the first file it reads
+_WORKER_PROCESS: Optional[Process] = None
+
+
+def read_and_split(path: str, private: bool = False) -> Tuple[list, float, float]:
+    """
+    Read and split one file with the default tools, in a worker process.
+
+    Top-level so that it can be sent to a ProcessPoolExecutor. The reader and
+    splitter are built once per worker process and reused for every file.
+
+    Args:
+        path (str): Path to the file.
+        private (bool): Whether to apply privacy settings to the documents. Default is False.
+
+    Returns:
+        Tuple[list, float, float]: The nodes of the file, the read time and the split time in seconds.
+    """
+    global _WORKER_PROCESS
+    if _WORKER_PROCESS is None:
+        _WORKER_PROCESS = Process(tools="default")
+    start = time.perf_counter()
+    _, documents = _WORKER_PROCESS.run(input_files=[path], private=private)
+    read_end = time.perf_counter()
+    nodes = list(_WORKER_PROCESS.iter_nodes(documents))
+    return nodes, read_end - start, time.perf_counter() - read_end
+
 
 if __name__ == "__main__":
     data_handler = Process()
@@ -0,0 +1,180 @@
+import hashlib
+import os
+import sqlite3
+import time
+from typing import List
+
+from tools.logger import config_logger
+
+# init log
+LOGGER = config_logger(
+    log_name="pgvec_manifest.log",
+    logger_name="pgvec_manifest",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Compute the sha256 of a file's content.
+
+    Args:
+        path (str): Path to the file.
+        chunk_size (int): Bytes read at a time. Defaults to 1 MiB.
+
+    Returns:
+        str: Hex digest of the content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Ingestion manifest of one vector table: file path -> content hash -> node ids.
+
+    The manifest is a small SQLite file committed after every ingested file, so it
+    doubles as the checkpoint of an interrupted run. Node ids are recorded as
+    "pending" before they are written to the vector database, so a crash between
+    the write and the commit never leaves untracked rows behind.
+
+    Attributes:
+        path (str): Path to the manifest SQLite file.
+        table_name (str): Name of the vector table the manifest belongs to.
+
+    Methods:
+        is_empty() -> bool:
+            Whether no file is tracked yet.
+
+        files() -> List[str]:
+            All tracked file paths.
+
+        is_unchanged(path: str, digest: str) -> bool:
+            Whether a file is fully ingested with the same content.
+
+        stale_node_ids(path: str) -> List[str]:
+            Node ids of a file which must be deleted before it is ingested again.
+
+        set_pending(path: str, node_ids: List[str]) -> None:
+            Record node ids which are about to be written.
+
+        commit(path: str, digest: str, node_ids: List[str]) -> None:
+            Record a fully ingested file.
+
+        remove(path: str) -> None:
+            Forget a file.
+
+        clear() -> None:
+            Forget every file.
+
+        close() -> None:
+            Close the SQLite connection.
+    """
+
+    def __init__(self, path: str, table_name: str) -> None:
+        """
+        Initialize the Manifest, creating the SQLite file if it does not exist.
+
+        Args:
+            path (str): Path to the manifest SQLite file.
+            table_name (str): Name of the vector table the manifest belongs to.
+        """
+        self.path = path
+        self.table_name = table_name
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self._conn = sqlite3.connect(path)
+        self._init_schema()
+        LOGGER.info(f"Load manifest '{path}' with {len(self.files())} files.")
+
+    def _init_schema(self) -> None:
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, hash TEXT, update_time REAL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS nodes (path TEXT, node_id TEXT, pending INTEGER)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS nodes_path_idx ON nodes (path)"
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO meta VALUES ('table_name', ?)",
+                (self.table_name,),
+            )
+        (table_name,) = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'table_name'"
+        ).fetchone()
+        if table_name != self.table_name:
+            raise ValueError(
+                f"Manifest '{self.path}' belongs to table '{table_name}', not '{self.table_name}'!"
+            )
+
+    def is_empty(self) -> bool:
+        return self._conn.execute("SELECT 1 FROM files LIMIT 1").fetchone() is None
+
+    def files(self) -> List[str]:
+        return [path for (path,) in self._conn.execute("SELECT path FROM files")]
+
+    def is_unchanged(self, path: str, digest: str) -> bool:
+        row = self._conn.execute(
+            "SELECT hash FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None or row[0] != digest:
+            return False
+        pending = self._conn.execute(
+            "SELECT 1 FROM nodes WHERE path = ? AND pending = 1 LIMIT 1", (path,)
+        ).fetchone()
+        return pending is None
+
+    def stale_node_ids(self, path: str) -> List[str]:
+        return [
+            node_id
+            for (node_id,) in self._conn.execute(
+                "SELECT node_id FROM nodes WHERE path = ?", (path,)
+            )
+        ]
+
+    def set_pending(self, path: str, node_ids: List[str]) -> None:
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO files VALUES (?, NULL, ?)", (path, time.time())
+            )
+            self._conn.executemany(
+                "INSERT INTO nodes VALUES (?, ?, 1)",
+                ((path, node_id) for node_id in node_ids),
+            )
+
+    def commit(self, path: str, digest: str, node_ids: List[str]) -> None:
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                (path, digest, time.time()),
+            )
+            self._conn.execute("DELETE FROM nodes WHERE path = ?", (path,))
+            self._conn.executemany(
+                "INSERT INTO nodes VALUES (?, ?, 0)",
+                ((path, node_id) for node_id in node_ids),
+            )
+
+    def remove(self, path: str) -> None:
+        with self._conn:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (path,))
+            self._conn.execute("DELETE FROM nodes WHERE path = ?", (path,))
+
+    def clear(self) -> None:
+        with self._conn:
+            self._conn.execute("DELETE FROM files")
+            self._conn.execute("DELETE FROM nodes")
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,34 @@
+"""
+Production launch of the RAG service: several uvicorn workers managed by gunicorn.
+
+Usage:
+    WEB_CONCURRENCY=4 gunicorn -c gunicorn.conf.py app:app
+
+Every worker imports app.py and builds its own models and services in the
+FastAPI lifespan; the state shared by the workers lives in Redis (see
+docs/Deployment.md).
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", str(min(4, multiprocessing.cpu_count()))))
+worker_class = "uvicorn.workers.UvicornWorker"
+# generation streams can last minutes
+timeout = int(os.environ.get("WORKER_TIMEOUT", "300"))
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", "60"))
+keepalive = 5
+# recycle workers now and then, jitter keeps them from restarting together
+max_requests = int(os.environ.get("MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+# build the services after the fork, every worker owns its connections
+preload_app = False
+accesslog = "-"
+
+# read by app.py and tools/logger.py in the workers
+os.environ["WEB_CONCURRENCY"] = str(workers)
+# workers append to the same log files, a restarted worker must not empty them,
+# and only one process may rotate a file safely: rotate with logrotate instead
+os.environ.setdefault("LOG_WRITE_MODE", "a")
+os.environ.setdefault("LOG_MAX_BYTES", "0")
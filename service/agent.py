@@ -1,12 +1,22 @@
+import asyncio
+import time
+from collections.abc import AsyncGenerator
+from typing import List, Optional, Tuple
+
 from core.handler.text_to_text import GenText
 from core.models.pattern import (
     Text2Text,
     TextEmbedding,
 )
 from core.prompt.main import PromptEngineerService
-from tools.logger import config_logger
+from tools.logger import config_logger, payload
+from tools.metrics import observe, timer
+from tools.trace_context import set_span_id
 
-from .pools.retriever import RetrieverService
+from .pools.memory import ConversationMemoryService
+from .pools.reranker import RerankerService
+from .pools.retriever import CodeLookup, RetrievalMode, RetrieverService
+from .pools.semantic_cache import SemanticCacheService
 
 
 class Agent:
@@ -16,14 +26,28 @@ class Agent:
     This class uses text generation,and retrieval services to process chat prompts and generate responses.
 
     Methods:
-        chat(prompt: str, file: Optional[Image.Image] = None) -> str:
-            Handle chat prompt with optional image input and generate a response.
+        chat(prompt: str, mode: Optional[RetrievalMode] = None) -> str:
+            Handle chat prompt and generate a response.
+
+        achat(prompt: str, mode: Optional[RetrievalMode] = None, user: Optional[str] = None) -> str:
+            Handle chat prompt asynchronously and generate a response.
+
+        astream_chat(prompt: str, mode: Optional[RetrievalMode] = None, user: Optional[str] = None) -> Tuple[List[dict], AsyncGenerator[str]]:
+            Handle chat prompt asynchronously and stream the response tokens.
     """
 
     def __init__(
         self,
         gen_text_model: Text2Text,
         text_emb_model: TextEmbedding,
+        semantic_cache: bool = False,
+        semantic_cache_kwargs: Optional[dict] = None,
+        prompt_kwargs: Optional[dict] = None,
+        retrieval_mode: RetrievalMode = "vector",
+        code_lookup: CodeLookup = "boost",
+        reranker: Optional[RerankerService] = None,
+        memory: bool = False,
+        memory_kwargs: Optional[dict] = None,
     ) -> None:
         """
         Initialize the Agent with various models and services.
@@ -31,19 +55,133 @@ class Agent:
         Args:
             gen_text_model (Text2Text): The text generation model.
             text_emb_model (TextEmbedding): The text embedding model.
+            semantic_cache (bool): Answer near-duplicate questions from the semantic cache. Defaults to False.
+            semantic_cache_kwargs (Optional[dict]): Settings of SemanticCacheService, e.g. threshold, max_size, ttl.
+            prompt_kwargs (Optional[dict]): Settings of PromptEngineerService, e.g. context_budget, tokenizer.
+            retrieval_mode (RetrievalMode): Default retrieval mode, "vector" or "hybrid". Defaults to "vector".
+            code_lookup (CodeLookup): Use of the product code index, "off", "boost" or "short_circuit". Defaults to "boost".
+            reranker (Optional[RerankerService]): Reranking stage after retrieval, None disables it.
+            memory (bool): Remember the conversation of every user in Redis. Defaults to False.
+            memory_kwargs (Optional[dict]): Settings of ConversationMemoryService, e.g. redis, window, token_budget.
 
         """
+        self.text_emb = text_emb_model
 
         self.gentxt_service = GenText(model=gen_text_model)
 
-        self.retriever_service = RetrieverService(text_emb_model=text_emb_model)
+        self.retriever_service = RetrieverService(
+            text_emb_model=text_emb_model,
+            mode=retrieval_mode,
+            code_lookup=code_lookup,
+            reranker=reranker,
+        )
+
+        self.prompt_engineer = PromptEngineerService(**(prompt_kwargs or {}))
+
+        self.semantic_cache = None
+        if semantic_cache:
+            self.semantic_cache = SemanticCacheService(
+                pgvec_db=self.retriever_service.pgvec_db,
+                **(semantic_cache_kwargs or {}),
+            )
+
+        self.memory = None
+        if memory:
+            self.memory = ConversationMemoryService(
+                gen_text=self.gentxt_service,
+                registry=self.prompt_engineer.registry,
+                token_counter=self.prompt_engineer.token_counter,
+                **(memory_kwargs or {}),
+            )
+
+    async def _alookup_answer(
+        self, prompt: str
+    ) -> Tuple[Optional[List[float]], Optional[str]]:
+        """
+        Look the prompt up in the semantic cache.
+
+        Args:
+            prompt (str): The chat prompt from the user.
+
+        Returns:
+            Tuple[Optional[List[float]], Optional[str]]: The prompt embedding and the cached answer, None when disabled or missed.
+        """
+        if self.semantic_cache is None:
+            return None, None
+        with timer("semantic_cache"):
+            await asyncio.to_thread(self.semantic_cache.refresh_version)
+            embedding = await self.text_emb.aget_query_embedding(prompt)
+            return embedding, self.semantic_cache.lookup(embedding=embedding)
+
+    async def _arecall(
+        self, log: config_logger, prompt: str, user: Optional[str]
+    ) -> Tuple[str, List[dict]]:
+        """
+        Load the conversation of the user and condense the prompt into a standalone question.
+
+        Args:
+            log (config_logger): logger.
+            prompt (str): The chat prompt from the user.
+            user (Optional[str]): Identity of the user, None answers without memory.
+
+        Returns:
+            Tuple[str, List[dict]]: The question used for the cache and retrieval, and the history messages.
+        """
+        if self.memory is None or user is None:
+            return prompt, []
+        with timer("memory_load"):
+            summary, turns = await self.memory.aload(user=user)
+        question = await self.memory.acondense(question=prompt, summary=summary, turns=turns)
+        if question != prompt:
+            log.info(f"Condensed prompt. :'{question}'.")
+        return question, self.memory.messages(summary=summary, turns=turns)
+
+    def _remember(self, user: Optional[str], prompt: str, response: str) -> None:
+        if self.memory is None or user is None:
+            return
+        if not response or response.startswith("Error occurred"):
+            return
+        self.memory.remember(user=user, question=prompt, answer=response)
 
-        self.prompt_engineer = PromptEngineerService()
+    async def _acache_answer(
+        self, prompt: str, embedding: Optional[List[float]], response: str
+    ) -> None:
+        if self.semantic_cache is None or embedding is None:
+            return
+        if not response or response.startswith("Error occurred"):
+            return
+        await self.semantic_cache.aadd(
+            question=prompt, embedding=embedding, answer=response
+        )
+
+    async def _agenerate(
+        self, log: config_logger, final_prompt: list
+    ) -> AsyncGenerator[str]:
+        """
+        Stream the answer tokens, timing the first token ("ttft") and the whole generation.
+
+        Args:
+            log (config_logger): logger.
+            final_prompt (list): The chat messages sent to the model.
+
+        Yields:
+            str: The generated tokens.
+        """
+        first_token = True
+        start = time.perf_counter()
+        async for token in self.gentxt_service.astream(prompt=final_prompt):
+            if first_token:
+                first_token = False
+                observe("ttft", time.perf_counter() - start)
+                log.info(f"Time to first token. :'{time.perf_counter() - start:.3f}s'.")
+            yield token
+        observe("generation", time.perf_counter() - start)
 
     def chat(
         self,
         log: config_logger,
         prompt: str,
+        mode: Optional[RetrievalMode] = None,
     ) -> str:
         """
         Handle chat prompt to generate a response.
@@ -51,23 +189,143 @@ class Agent:
         Args:
             log (config_logger): logger.
             prompt (str): The chat prompt from the user.
+            mode (Optional[RetrievalMode]): Retrieval mode of this request, None uses the default mode.
 
         Returns:
             str: The generated response from the agent.
         """
 
         log.info("Start chat!")
-        log.info(f"User prompt:'{prompt}'.")
+        log.info(f"User prompt:'{payload(prompt)}'.")
 
-        retriever = self.retriever_service.search(data=prompt)
-        log.info(f"Retriever. :'{retriever}'.")
+        nodes = self.retriever_service.retrieve(data=prompt, mode=mode)
+        retriever = self.prompt_engineer.assemble_context(nodes=nodes)
+        log.info(f"Retriever. :'{payload(retriever)}'.")
         final_prompt = self.prompt_engineer.generate(
             retrieval=retriever,
             question=prompt,
             instruction=None,
         )
-        log.info(f"Final prompt. :'{final_prompt}'.")
+        log.info(f"Final prompt. :'{payload(final_prompt)}'.")
         response = self.gentxt_service.run(prompt=final_prompt)
-        log.info(f"Response. :'{response}'.")
+        log.info(f"Response. :'{payload(response)}'.")
 
         return response
+
+    async def achat(
+        self,
+        log: config_logger,
+        prompt: str,
+        mode: Optional[RetrievalMode] = None,
+        user: Optional[str] = None,
+    ) -> str:
+        """
+        Handle chat prompt to generate a response without blocking the event loop.
+
+        Args:
+            log (config_logger): logger.
+            prompt (str): The chat prompt from the user.
+            mode (Optional[RetrievalMode]): Retrieval mode of this request, None uses the default mode.
+            user (Optional[str]): Identity of the user for the conversation memory, None answers without memory.
+
+        Returns:
+            str: The generated response from the agent.
+        """
+
+        log.info("Start chat!")
+        log.info(f"User prompt:'{payload(prompt)}'.")
+
+        question, history = await self._arecall(log=log, prompt=prompt, user=user)
+        embedding, cached = await self._alookup_answer(prompt=question)
+        if cached is not None:
+            log.info(f"Response from semantic cache. :'{payload(cached)}'.")
+            # nothing was generated, there is no trace to attach feedback to
+            set_span_id(None)
+            self._remember(user=user, prompt=prompt, response=cached)
+            return cached
+
+        nodes = await self.retriever_service.aretrieve(data=question, mode=mode)
+        retriever = self.prompt_engineer.assemble_context(nodes=nodes)
+        log.info(f"Retriever. :'{payload(retriever)}'.")
+        final_prompt = self.prompt_engineer.generate(
+            retrieval=retriever,
+            question=prompt,
+            instruction=None,
+            history=history,
+        )
+        log.info(f"Final prompt. :'{payload(final_prompt)}'.")
+        response = ""
+        async for token in self._agenerate(log=log, final_prompt=final_prompt):
+            response += token
+        log.info(f"Response. :'{payload(response)}'.")
+        await self._acache_answer(prompt=question, embedding=embedding, response=response)
+        self._remember(user=user, prompt=prompt, response=response)
+
+        return response
+
+    async def astream_chat(
+        self,
+        log: config_logger,
+        prompt: str,
+        mode: Optional[RetrievalMode] = None,
+        user: Optional[str] = None,
+    ) -> Tuple[List[dict], AsyncGenerator[str]]:
+        """
+        Handle chat prompt and stream the response tokens as the model generates them.
+
+        Args:
+            log (config_logger): logger.
+            prompt (str): The chat prompt from the user.
+            mode (Optional[RetrievalMode]): Retrieval mode of this request, None uses the default mode.
+            user (Optional[str]): Identity of the user for the conversation memory, None answers without memory.
+
+        Returns:
+            Tuple[List[dict], AsyncGenerator[str]]: The retrieval metadata and a generator of response tokens.
+        """
+
+        log.info("Start stream chat!")
+        log.info(f"User prompt:'{payload(prompt)}'.")
+
+        question, history = await self._arecall(log=log, prompt=prompt, user=user)
+        embedding, cached = await self._alookup_answer(prompt=question)
+        if cached is not None:
+            log.info(f"Response from semantic cache. :'{payload(cached)}'.")
+            # nothing was generated, there is no trace to attach feedback to
+            set_span_id(None)
+            self._remember(user=user, prompt=prompt, response=cached)
+
+            async def cached_tokens() -> AsyncGenerator[str]:
+                yield cached
+
+            return [], cached_tokens()
+
+        nodes = await self.retriever_service.aretrieve(data=question, mode=mode)
+        retriever = self.prompt_engineer.assemble_context(nodes=nodes)
+        log.info(f"Retriever. :'{payload(retriever)}'.")
+        retrieval_info = [
+            {
+                "node_id": node.node.node_id,
+                "score": node.score,
+                "file_name": node.node.metadata.get("file_name"),
+                "page_number": node.node.metadata.get("page_number"),
+            }
+            for node in nodes
+        ]
+        final_prompt = self.prompt_engineer.generate(
+            retrieval=retriever,
+            question=prompt,
+            instruction=None,
+            history=history,
+        )
+        log.info(f"Final prompt. :'{payload(final_prompt)}'.")
+
+        async def tokens() -> AsyncGenerator[str]:
+            response = ""
+            async for token in self._agenerate(log=log, final_prompt=final_prompt):
+                response += token
+                yield token
+            log.info(f"Response. :'{payload(response)}'.")
+            await self._acache_answer(prompt=question, embedding=embedding, response=response)
+            self._remember(user=user, prompt=prompt, response=response)
+
+        return retrieval_info, tokens()
@@ -1,3 +1,6 @@
+from .memory import ConversationMemoryService
+from .reranker import RerankerService
 from .retriever import RetrieverService
+from .semantic_cache import SemanticCacheService
 
-__all__ = ['RetrieverService']
\ No newline at end of file
+__all__ = ['ConversationMemoryService','RerankerService','RetrieverService','SemanticCacheService']
\ No newline at end of file
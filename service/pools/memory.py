@@ -0,0 +1,291 @@
+import asyncio
+import json
+import time
+import uuid
+from typing import List, Optional, Set, Tuple
+
+from core.handler.text_to_text import GenText
+from core.prompt.registry import TemplateRegistry
+from tools.logger import config_logger
+from tools.metrics import timer
+from tools.redis_handler import RedisNotifier
+from tools.tokenizer import TokenCounter
+
+# delete the lock only if it still holds our token, it may have expired and been taken since
+_RELEASE_LOCK = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# init log
+LOGGER = config_logger(
+    log_name="memory.log",
+    logger_name="memory",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+
+class ConversationMemoryService:
+    """
+    Per-user conversation memory in Redis: the latest turns plus a rolling summary.
+
+    Every user has a list of turns "<prefix>:<user>:turns" and a summary
+    "<prefix>:<user>:summary". Once the turns exceed `window` or `token_budget`,
+    the oldest ones are folded into the summary by the LLM, so the history sent
+    with a prompt stays bounded. Saving and summarizing run in background tasks,
+    after the answer is sent. Condensing and summarizing never publish their span
+    id, feedback stays attached to the answer's generation.
+
+    Attributes:
+        redis (RedisNotifier): Redis connection.
+        window (int): Maximum number of turns kept verbatim.
+        token_budget (int): Maximum number of tokens of the turns kept verbatim.
+        ttl (int): Seconds before the memory of an inactive user expires.
+
+    Methods:
+        aload(user: str) -> Tuple[str, List[dict]]:
+            Load the summary and the turns of a user.
+
+        messages(summary: str, turns: List[dict]) -> List[dict]:
+            Convert the memory into chat messages.
+
+        acondense(question: str, summary: str, turns: List[dict]) -> str:
+            Rewrite a follow-up question into a standalone question for retrieval.
+
+        remember(user: str, question: str, answer: str) -> None:
+            Save a turn in the background.
+
+        clear(user: str) -> None:
+            Forget the conversation of a user.
+    """
+
+    def __init__(
+        self,
+        redis: RedisNotifier,
+        gen_text: GenText,
+        registry: TemplateRegistry,
+        window: int = 6,
+        token_budget: int = 1024,
+        ttl: int = 7 * 86400,
+        prefix: str = "memory",
+        condense: bool = True,
+        token_counter: Optional[TokenCounter] = None,
+    ) -> None:
+        """
+        Initialize the ConversationMemoryService.
+
+        Args:
+            redis (RedisNotifier): Redis connection.
+            gen_text (GenText): Text generation used to summarize and condense.
+            registry (TemplateRegistry): Registry of the "memory_summary" and "memory_condense" templates.
+            window (int): Maximum number of turns kept verbatim. Defaults to 6.
+            token_budget (int): Maximum number of tokens of the turns kept verbatim. Defaults to 1024.
+            ttl (int): Seconds before the memory of an inactive user expires. Defaults to 7 days.
+            prefix (str): Prefix of the Redis keys. Defaults to "memory".
+            condense (bool): Rewrite follow-up questions before retrieval. Defaults to True.
+            token_counter (Optional[TokenCounter]): Counts the tokens of the turns, None uses the estimate.
+        """
+        if window < 1:
+            raise ValueError("window must be greater than 0!")
+        self.redis = redis
+        self.gen_text = gen_text
+        self.registry = registry
+        self.window = window
+        self.token_budget = token_budget
+        self.ttl = ttl
+        self.prefix = prefix
+        self.condense = condense
+        self.token_counter = token_counter if token_counter is not None else TokenCounter()
+        # keep references, the event loop only keeps weak ones to running tasks
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _key(self, user: str, name: str) -> str:
+        return f"{self.prefix}:{user}:{name}"
+
+    def _load(self, user: str) -> Tuple[str, List[dict]]:
+        pipeline = self.redis.cursor.pipeline()
+        pipeline.get(self._key(user, "summary"))
+        pipeline.lrange(self._key(user, "turns"), 0, -1)
+        with timer("redis"):
+            summary, turns = pipeline.execute()
+        return (
+            summary.decode("utf-8") if summary else "",
+            [json.loads(turn) for turn in turns],
+        )
+
+    async def aload(self, user: str) -> Tuple[str, List[dict]]:
+        """
+        Load the summary and the turns of a user in one round trip.
+
+        Args:
+            user (str): Identity of the user.
+
+        Returns:
+            Tuple[str, List[dict]]: The summary, empty if none, and the turns, oldest first.
+        """
+        try:
+            return await asyncio.to_thread(self._load, user)
+        except Exception as e:
+            # answer without memory rather than fail the chat
+            LOGGER.error(f"Can not load memory of '{user}': {e}")
+            return "", []
+
+    @staticmethod
+    def _history(turns: List[dict]) -> str:
+        return "\n".join(
+            f"User: {turn['question']}\nAssistant: {turn['answer']}" for turn in turns
+        )
+
+    def messages(self, summary: str, turns: List[dict]) -> List[dict]:
+        """
+        Convert the memory into chat messages, placed before the new question.
+
+        Args:
+            summary (str): The summary of the earlier conversation.
+            turns (List[dict]): The latest turns.
+
+        Returns:
+            List[dict]: The chat messages.
+        """
+        messages = []
+        if summary:
+            messages.append(
+                {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+            )
+        for turn in turns:
+            messages.append({"role": "user", "content": turn["question"]})
+            messages.append({"role": "assistant", "content": turn["answer"]})
+        return messages
+
+    async def acondense(self, question: str, summary: str, turns: List[dict]) -> str:
+        """
+        Rewrite a follow-up question into a standalone question for retrieval.
+
+        Args:
+            question (str): The question of the user.
+            summary (str): The summary of the earlier conversation.
+            turns (List[dict]): The latest turns.
+
+        Returns:
+            str: The standalone question, the question itself without history or on failure.
+        """
+        if not self.condense or not (summary or turns):
+            return question
+        start = time.perf_counter()
+        with timer("condense"):
+            condensed = await self._acondense(question=question, summary=summary, turns=turns)
+        if not condensed or condensed.startswith("Error occurred"):
+            return question
+        LOGGER.info(
+            f"Condensed '{question}' -> '{condensed}' in {time.perf_counter() - start:.3f}s."
+        )
+        return condensed
+
+    async def _acondense(self, question: str, summary: str, turns: List[dict]) -> str:
+        history = "\n".join(filter(None, [summary, self._history(turns)]))
+        prompt = self.registry.render("memory_condense", history=history, question=question)
+        condensed = await self.gen_text.arun(
+            prompt=[{"role": "user", "content": prompt}],
+            max_tokens=64,
+            notify_span=False,
+        )
+        return condensed.strip().strip('"')
+
+    def remember(self, user: str, question: str, answer: str) -> None:
+        """
+        Save a turn in the background, summarizing old turns when the history is over budget.
+
+        Args:
+            user (str): Identity of the user.
+            question (str): The question of the user.
+            answer (str): The answer.
+        """
+        task = asyncio.get_running_loop().create_task(
+            self._asave(user=user, question=question, answer=answer)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _append(self, user: str, question: str, answer: str) -> List[dict]:
+        turns_key, summary_key = self._key(user, "turns"), self._key(user, "summary")
+        turn = json.dumps(
+            {"question": question, "answer": answer, "time": time.time()},
+            ensure_ascii=False,
+        )
+        pipeline = self.redis.cursor.pipeline()
+        pipeline.rpush(turns_key, turn)
+        pipeline.expire(turns_key, self.ttl)
+        pipeline.expire(summary_key, self.ttl)
+        pipeline.lrange(turns_key, 0, -1)
+        with timer("redis"):
+            turns = pipeline.execute()[-1]
+        return [json.loads(turn) for turn in turns]
+
+    def _to_fold(self, turns: List[dict]) -> int:
+        tokens = [self.token_counter.count(turn["question"] + turn["answer"]) for turn in turns]
+        fold = 0
+        # always keep the latest turn verbatim
+        while fold < len(turns) - 1 and (
+            len(turns) - fold > self.window or sum(tokens[fold:]) > self.token_budget
+        ):
+            fold += 1
+        return fold
+
+    async def _asave(self, user: str, question: str, answer: str) -> None:
+        try:
+            turns = await asyncio.to_thread(self._append, user, question, answer)
+            if self._to_fold(turns):
+                await self._asummarize(user=user)
+        except Exception as e:
+            LOGGER.error(f"Can not save memory of '{user}': {e}")
+
+    async def _asummarize(self, user: str) -> None:
+        lock_key = self._key(user, "lock")
+        # one summarization per user at a time, across workers; a skipped one is redone next turn
+        token = uuid.uuid4().hex
+        if not await asyncio.to_thread(
+            self.redis.cursor.set, lock_key, token, nx=True, ex=120
+        ):
+            return
+        try:
+            start = time.perf_counter()
+            # another task may have folded since the turns were appended, decide under the lock
+            summary, turns = await asyncio.to_thread(self._load, user)
+            turns = turns[: self._to_fold(turns)]
+            if not turns:
+                return
+            prompt = self.registry.render(
+                "memory_summary", summary=summary, history=self._history(turns)
+            )
+            new_summary = await self.gen_text.arun(
+                prompt=[{"role": "user", "content": prompt}],
+                max_tokens=256,
+                notify_span=False,
+            )
+            if not new_summary.strip() or new_summary.startswith("Error occurred"):
+                LOGGER.warning(f"Summarization of '{user}' failed: {new_summary}")
+                return
+            pipeline = self.redis.cursor.pipeline()
+            pipeline.set(self._key(user, "summary"), new_summary.strip(), ex=self.ttl)
+            # new turns are pushed on the right, dropping from the left is safe
+            pipeline.ltrim(self._key(user, "turns"), len(turns), -1)
+            with timer("redis"):
+                await asyncio.to_thread(pipeline.execute)
+            LOGGER.info(
+                f"Folded {len(turns)} turns of '{user}' into the summary in {time.perf_counter() - start:.2f}s."
+            )
+        finally:
+            await asyncio.to_thread(self.redis.cursor.eval, _RELEASE_LOCK, 1, lock_key, token)
+
+    def clear(self, user: str) -> None:
+        """
+        Forget the conversation of a user.
+
+        Args:
+            user (str): Identity of the user.
+        """
+        self.redis.cursor.delete(self._key(user, "turns"), self._key(user, "summary"))
@@ -0,0 +1,116 @@
+import time
+from typing import List, Optional
+
+from llama_index.core.schema import NodeWithScore
+
+from core.models.pattern import Reranker
+from tools.logger import config_logger
+from tools.metrics import observe
+from tools.tokenizer import count_tokens
+
+# init log
+LOGGER = config_logger(
+    log_name="reranker_service.log",
+    logger_name="reranker_service",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+
+class RerankerService:
+    """
+    Reranking stage between retrieval and prompt building.
+
+    Scores the retrieved candidates with a reranker model and keeps the best
+    `top_n` ones whose score reaches `score_threshold`.
+
+    Attributes:
+        model (Reranker): The reranker model, e.g. CrossEncoderReranker or OllamaReranker.
+        top_n (int): Maximum number of nodes kept.
+        score_threshold (Optional[float]): Minimum score of a kept node, None keeps the top_n.
+
+    Methods:
+        rerank(query: str, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+            Rerank the retrieved nodes.
+
+        arerank(query: str, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+            Rerank the retrieved nodes without blocking the event loop.
+    """
+
+    def __init__(
+        self,
+        model: Reranker,
+        top_n: int = 4,
+        score_threshold: Optional[float] = None,
+    ) -> None:
+        """
+        Initialize the RerankerService.
+
+        Args:
+            model (Reranker): The reranker model.
+            top_n (int): Maximum number of nodes kept. Defaults to 4.
+            score_threshold (Optional[float]): Minimum score of a kept node, in the scale of the model. Defaults to None.
+        """
+        if top_n < 1:
+            raise ValueError("top_n must be greater than 0!")
+        self.model = model
+        self.top_n = top_n
+        self.score_threshold = score_threshold
+
+    def _select(
+        self, nodes: List[NodeWithScore], scores: List[float], start: float
+    ) -> List[NodeWithScore]:
+        observe("rerank", time.perf_counter() - start)
+        ranked = sorted(zip(nodes, scores), key=lambda pair: pair[1], reverse=True)
+        kept = [
+            NodeWithScore(node=node.node, score=score)
+            for node, score in ranked[: self.top_n]
+            if self.score_threshold is None or score >= self.score_threshold
+        ]
+        tokens_in = sum(count_tokens(node.node.get_content()) for node in nodes)
+        tokens_out = sum(count_tokens(node.node.get_content()) for node in kept)
+        LOGGER.info(
+            f"Rerank {len(nodes)} -> {len(kept)} nodes with {self.model.model_name} in "
+            f"{time.perf_counter() - start:.3f}s, saved {tokens_in - tokens_out} tokens "
+            f"({tokens_in} -> {tokens_out})."
+        )
+        return kept
+
+    def rerank(self, query: str, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
+        """
+        Rerank the retrieved nodes.
+
+        Args:
+            query (str): The user question.
+            nodes (List[NodeWithScore]): The retrieved candidates.
+
+        Returns:
+            List[NodeWithScore]: The kept nodes, best first, the score is the reranker score.
+        """
+        if not nodes:
+            return nodes
+        start = time.perf_counter()
+        scores = self.model.score(query, [node.node.get_content() for node in nodes])
+        return self._select(nodes, scores, start)
+
+    async def arerank(
+        self, query: str, nodes: List[NodeWithScore]
+    ) -> List[NodeWithScore]:
+        """
+        Rerank the retrieved nodes without blocking the event loop.
+
+        Args:
+            query (str): The user question.
+            nodes (List[NodeWithScore]): The retrieved candidates.
+
+        Returns:
+            List[NodeWithScore]: The kept nodes, best first, the score is the reranker score.
+        """
+        if not nodes:
+            return nodes
+        start = time.perf_counter()
+        scores = await self.model.ascore(
+            query, [node.node.get_content() for node in nodes]
+        )
+        return self._select(nodes, scores, start)
@@ -1,7 +1,75 @@
+import asyncio
+import time
+from typing import Dict, List, Literal, Optional
+
 from llama_index.core import VectorStoreIndex
+from llama_index.core.schema import NodeWithScore, QueryBundle
 
 from core.models.minillm import MinillmModel
+from core.vec_db.pgvector.codes import extract_codes
 from core.vec_db.pgvector.main import Operator as PgvecDB
+from tools.logger import config_logger
+from tools.metrics import timer
+
+from .reranker import RerankerService
+
+# init log
+LOGGER = config_logger(
+    log_name="retriever.log",
+    logger_name="retriever",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+RetrievalMode = Literal["vector", "hybrid"]
+CodeLookup = Literal["off", "boost", "short_circuit"]
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[NodeWithScore]], k: int = 60, top_k: Optional[int] = None
+) -> List[NodeWithScore]:
+    """
+    Fuse several rankings of nodes with reciprocal rank fusion.
+
+    Every node scores sum(1 / (k + rank)) over the rankings it appears in, so
+    only the ranks matter and scores of different retrievers need no calibration.
+
+    Args:
+        rankings (List[List[NodeWithScore]]): Rankings, best node first.
+        k (int): Damping constant, larger values flatten the head of each ranking. Defaults to 60.
+        top_k (Optional[int]): Number of nodes kept, None keeps all.
+
+    Returns:
+        List[NodeWithScore]: The fused ranking, the score is the fused score.
+    """
+    scores: Dict[str, float] = {}
+    nodes: Dict[str, NodeWithScore] = {}
+    for ranking in rankings:
+        for rank, node in enumerate(ranking, start=1):
+            node_id = node.node.node_id
+            scores[node_id] = scores.get(node_id, 0.0) + 1.0 / (k + rank)
+            nodes.setdefault(node_id, node)
+    fused = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [NodeWithScore(node=nodes[node_id].node, score=scores[node_id]) for node_id in fused]
+
+
+def boost(
+    boosted: List[NodeWithScore], nodes: List[NodeWithScore], top_k: int
+) -> List[NodeWithScore]:
+    """
+    Put the boosted nodes first, followed by the other nodes without duplicates.
+
+    Args:
+        boosted (List[NodeWithScore]): Nodes to rank first.
+        nodes (List[NodeWithScore]): The ranking to boost.
+        top_k (int): Number of nodes kept.
+
+    Returns:
+        List[NodeWithScore]: The boosted ranking.
+    """
+    seen = {node.node.node_id for node in boosted}
+    return (boosted + [node for node in nodes if node.node.node_id not in seen])[:top_k]
 
 
 class RetrieverService:
@@ -13,18 +81,47 @@ class RetrieverService:
         pgvec_db (PgvecDB): Vector database for text data retrieval.
 
     Methods:
-        search(data: str) -> str:
+        search(data: str, mode: Optional[RetrievalMode] = None) -> str:
             Search data from the database .
+
+        asearch(data: str, mode: Optional[RetrievalMode] = None) -> str:
+            Asynchronously search data from the database .
+
+        aretrieve(data: str, mode: Optional[RetrievalMode] = None) -> List[NodeWithScore]:
+            Asynchronously retrieve the ranked nodes from the database .
     """
 
-    def __init__(self, text_emb_model: MinillmModel) -> None:
+    def __init__(
+        self,
+        text_emb_model: MinillmModel,
+        mode: RetrievalMode = "vector",
+        top_k: int = 10,
+        rrf_k: int = 60,
+        code_lookup: CodeLookup = "boost",
+        reranker: Optional[RerankerService] = None,
+    ) -> None:
         """
         Initialize the RetrieverService with text .
 
         Args:
             text_emb_model (MinillmModel): The text embedding model.
+            mode (RetrievalMode): Default retrieval mode, "vector" or "hybrid" (full-text + vector). Defaults to "vector".
+            top_k (int): Number of nodes retrieved by each search. Defaults to 10.
+            rrf_k (int): Damping constant of the reciprocal rank fusion in "hybrid" mode. Defaults to 60.
+            code_lookup (CodeLookup): What to do with the nodes mentioning a product code of the query:
+                "boost" ranks them first, "short_circuit" returns them without the vector search, "off" ignores the code index. Defaults to "boost".
+            reranker (Optional[RerankerService]): Reranking stage applied to the retrieved nodes, None keeps the retrieval order.
         """
+        if mode not in ("vector", "hybrid"):
+            raise ValueError(f"Unknown retrieval mode '{mode}'!")
+        if code_lookup not in ("off", "boost", "short_circuit"):
+            raise ValueError(f"Unknown code lookup '{code_lookup}'!")
+        self.code_lookup = code_lookup
+        self.reranker = reranker
         self.text_emb = text_emb_model
+        self.mode = mode
+        self.top_k = top_k
+        self.rrf_k = rrf_k
 
         self.pgvec_db = PgvecDB()
 
@@ -38,18 +135,100 @@ class RetrieverService:
         )
         retriever = index.as_retriever(
             # vector_store_query_mode="hybrid",
-            similarity_top_k=10,
+            similarity_top_k=self.top_k,
             vector_store_kwargs={"hnsw_ef_search": 40},
             # filters=filters,
         )
         return retriever
 
-    def _search_from_pgvecdb(self, data: str) -> str:
+    def _resolve_mode(self, mode: Optional[RetrievalMode]) -> RetrievalMode:
+        mode = mode or self.mode
+        if mode not in ("vector", "hybrid"):
+            raise ValueError(f"Unknown retrieval mode '{mode}'!")
+        return mode
+
+    def _vector_search(self, data: str) -> List[NodeWithScore]:
+        # embed apart from the search, so that both stages are timed
+        with timer("embed_query"):
+            embedding = self.text_emb.get_query_embedding(data)
+        with timer("vector_search"):
+            return self.pg_retriver.retrieve(QueryBundle(query_str=data, embedding=embedding))
+
+    async def _avector_search(self, data: str) -> List[NodeWithScore]:
+        with timer("embed_query"):
+            embedding = await self.text_emb.aget_query_embedding(data)
+        with timer("vector_search"):
+            return await self.pg_retriver.aretrieve(
+                QueryBundle(query_str=data, embedding=embedding)
+            )
+
+    def _text_search(self, data: str) -> List[NodeWithScore]:
+        with timer("text_search"):
+            return self.pgvec_db.text_search(query=data, top_k=self.top_k)
+
+    def _use_codes(self, data: str) -> bool:
+        return self.code_lookup != "off" and bool(extract_codes(data))
+
+    def _code_search(self, data: str) -> List[NodeWithScore]:
+        start = time.perf_counter()
+        with timer("code_search"):
+            nodes = self.pgvec_db.code_search(query=data, top_k=self.top_k)
+        LOGGER.info(
+            f"Code lookup in {time.perf_counter() - start:.3f}s: {extract_codes(data)} -> {len(nodes)} nodes."
+        )
+        return nodes
+
+    def _fuse(
+        self, vector_nodes: List[NodeWithScore], text_nodes: List[NodeWithScore], start: float
+    ) -> List[NodeWithScore]:
+        nodes = reciprocal_rank_fusion(
+            [vector_nodes, text_nodes], k=self.rrf_k, top_k=self.top_k
+        )
+        LOGGER.info(
+            f"Hybrid retrieval in {time.perf_counter() - start:.3f}s: "
+            f"{len(vector_nodes)} vector + {len(text_nodes)} full-text -> {len(nodes)} nodes."
+        )
+        return nodes
+
+    def retrieve(
+        self, data: str, mode: Optional[RetrievalMode] = None
+    ) -> List[NodeWithScore]:
+        """
+        Retrieve the ranked nodes from the PgvecDB.
+
+        Args:
+            data (str): The text data to be searched.
+            mode (Optional[RetrievalMode]): "vector" or "hybrid", None uses the default mode.
+
+        Returns:
+            List[NodeWithScore]: The retrieved nodes with their scores.
+        """
+        with timer("retrieval"):
+            nodes = self._candidates(data=data, mode=self._resolve_mode(mode))
+            if self.reranker is not None:
+                nodes = self.reranker.rerank(query=data, nodes=nodes)
+        return nodes
+
+    def _candidates(self, data: str, mode: RetrievalMode) -> List[NodeWithScore]:
+        code_nodes = self._code_search(data) if self._use_codes(data) else []
+        if code_nodes and self.code_lookup == "short_circuit":
+            return code_nodes
+        if mode == "vector":
+            nodes = self._vector_search(data)
+        else:
+            start = time.perf_counter()
+            nodes = self._fuse(self._vector_search(data), self._text_search(data), start)
+        return boost(code_nodes, nodes, top_k=self.top_k)
+
+    def _search_from_pgvecdb(
+        self, data: str, mode: Optional[RetrievalMode] = None
+    ) -> str:
         """
         Search for text data in the PgvecDB.
 
         Args:
             data (str): The text data to be searched.
+            mode (Optional[RetrievalMode]): "vector" or "hybrid", None uses the default mode.
 
         Returns:
             str: The content of the top-ranked document if found, otherwise None.
@@ -59,22 +238,99 @@ class RetrieverService:
         #         MetadataFilter(key="fixes", value="5680", operator="contains"),
         #     ]
         # )
-        retrieved_nodes = self.pg_retriver.retrieve(data)
-        return "".join(node.text for node in retrieved_nodes)
+        retrieved_nodes = self.retrieve(data=data, mode=mode)
+        return "\n\n".join(node.text for node in retrieved_nodes)
+
+    async def _asearch_from_pgvecdb(
+        self, data: str, mode: Optional[RetrievalMode] = None
+    ) -> str:
+        """
+        Asynchronously search for text data in the PgvecDB.
+
+        Args:
+            data (str): The text data to be searched.
+            mode (Optional[RetrievalMode]): "vector" or "hybrid", None uses the default mode.
+
+        Returns:
+            str: The content of the top-ranked document if found, otherwise None.
+        """
+        retrieved_nodes = await self.aretrieve(data=data, mode=mode)
+        return "\n\n".join(node.text for node in retrieved_nodes)
 
-    def search(self, data: str) -> str:
+    async def aretrieve(
+        self, data: str, mode: Optional[RetrievalMode] = None
+    ) -> List[NodeWithScore]:
+        """
+        Asynchronously retrieve the ranked nodes from the PgvecDB.
+
+        In "hybrid" mode the vector search and the full-text search run concurrently
+        and their rankings are fused with reciprocal rank fusion. Nodes mentioning a
+        product code of the query are looked up first in the code index. With a
+        reranker, the candidates are reranked and cut down last.
+
+        Args:
+            data (str): The text data to be searched.
+            mode (Optional[RetrievalMode]): "vector" or "hybrid", None uses the default mode.
+
+        Returns:
+            List[NodeWithScore]: The retrieved nodes with their scores.
+        """
+        with timer("retrieval"):
+            nodes = await self._acandidates(data=data, mode=self._resolve_mode(mode))
+            if self.reranker is not None:
+                nodes = await self.reranker.arerank(query=data, nodes=nodes)
+        return nodes
+
+    async def _acandidates(
+        self, data: str, mode: RetrievalMode
+    ) -> List[NodeWithScore]:
+        code_nodes = []
+        if self._use_codes(data):
+            code_nodes = await asyncio.to_thread(self._code_search, data)
+        if code_nodes and self.code_lookup == "short_circuit":
+            return code_nodes
+        if mode == "vector":
+            nodes = await self._avector_search(data)
+        else:
+            start = time.perf_counter()
+            vector_nodes, text_nodes = await asyncio.gather(
+                self._avector_search(data),
+                asyncio.to_thread(self._text_search, data),
+            )
+            nodes = self._fuse(vector_nodes, text_nodes, start)
+        return boost(code_nodes, nodes, top_k=self.top_k)
+
+    def search(self, data: str, mode: Optional[RetrievalMode] = None) -> str:
         """
         Search data from the database .
 
         Args:
             data (str): The data to be searched.
+            mode (Optional[RetrievalMode]): "vector" or "hybrid", None uses the default mode.
+
+        Returns:
+            str: The content or description of the top-ranked result.
+
+        """
+
+        retriever_result = self._search_from_pgvecdb(data=data, mode=mode)
+
+        return retriever_result
+
+    async def asearch(self, data: str, mode: Optional[RetrievalMode] = None) -> str:
+        """
+        Asynchronously search data from the database .
+
+        Args:
+            data (str): The data to be searched.
+            mode (Optional[RetrievalMode]): "vector" or "hybrid", None uses the default mode.
 
         Returns:
             str: The content or description of the top-ranked result.
 
         """
 
-        retriever_result = self._search_from_pgvecdb(data=data)
+        retriever_result = await self._asearch_from_pgvecdb(data=data, mode=mode)
 
         return retriever_result
 
@@ -85,5 +341,5 @@ if __name__ == "__main__":
     test_data = "what is EGPS-3401"
     model = MinillmModel(host="10.204.16.50")
     retriever_service = RetrieverService(text_emb_model=model)
-    result = retriever_service.search(data=test_data)
+    result = retriever_service.search(data=test_data, mode="hybrid")
     print(result)
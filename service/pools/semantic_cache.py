@@ -0,0 +1,317 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from core.vec_db.pgvector.main import Operator as PgvecDB
+from tools.logger import config_logger
+from tools.metrics import timer
+from tools.redis_handler import RedisNotifier
+
+# init log
+LOGGER = config_logger(
+    log_name="semantic_cache.log",
+    logger_name="semantic_cache",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+
+class SemanticCacheService:
+    """
+    Semantic response cache for the RAG pipeline.
+
+    Answers are indexed in process by the embedding of their question. A new question
+    whose cosine distance to a cached question is within the threshold gets the cached
+    answer without retrieval or generation. Entries carry the table name and ingestion
+    version, so they go stale as soon as the table is re-vectorized.
+
+    With a Redis connection, cached answers are also appended to a Redis stream
+    which every worker reads when it refreshes the version, so an answer cached
+    by one worker is a hit for all of them.
+
+    Attributes:
+        threshold (float): Maximum cosine distance for a hit.
+        max_size (int): Maximum number of cached answers.
+        ttl (float): Seconds an answer stays valid.
+
+    Methods:
+        lookup(embedding: List[float]) -> Optional[str]:
+            Get the cached answer of the nearest question.
+
+        add(question: str, embedding: List[float], answer: str) -> None:
+            Cache an answer.
+
+        aadd(question: str, embedding: List[float], answer: str) -> None:
+            Cache an answer, sharing it without blocking the event loop.
+
+        refresh_version(force: bool = False) -> str:
+            Re-read the ingestion version of the table.
+
+        stats() -> dict:
+            Hit-rate metrics for monitoring.
+    """
+
+    def __init__(
+        self,
+        pgvec_db: PgvecDB,
+        threshold: float = 0.05,
+        max_size: int = 1024,
+        ttl: float = 86400,
+        version_interval: float = 60,
+        redis: Optional[RedisNotifier] = None,
+        sync_interval: float = 1.0,
+    ) -> None:
+        """
+        Initialize the SemanticCacheService.
+
+        Args:
+            pgvec_db (PgvecDB): The vector database the answers are generated from.
+            threshold (float): Maximum cosine distance for a hit. Defaults to 0.05.
+            max_size (int): Maximum number of cached answers. Defaults to 1024.
+            ttl (float): Seconds an answer stays valid. Defaults to 86400.
+            version_interval (float): Seconds between two reads of the ingestion version. Defaults to 60.
+            redis (Optional[RedisNotifier]): Redis connection sharing the answers across workers, None keeps them in process.
+            sync_interval (float): Seconds between two reads of the answers cached by other workers. Defaults to 1.
+        """
+        self.pgvec_db = pgvec_db
+        self.table_name = pgvec_db.table_name
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version_interval = version_interval
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        self._next_id = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_ids: List[int] = []
+        self._version: Optional[str] = None
+        self._version_time = 0.0
+        self._lock = threading.Lock()
+
+        self.redis = redis
+        self.sync_interval = sync_interval
+        self.stream_key = f"semantic_cache:{self.table_name}"
+        self._origin = uuid.uuid4().hex
+        # read the answers already shared, at most max_size of them
+        self._stream_id = "0-0"
+        self._sync_time = 0.0
+
+    def _sync(self) -> None:
+        """
+        Add the answers cached by other workers since the last read of the stream.
+        """
+        now = time.monotonic()
+        if self.redis is None or now - self._sync_time < self.sync_interval:
+            return
+        self._sync_time = now
+        try:
+            with timer("redis"):
+                streams = self.redis.cursor.xread(
+                    {self.stream_key: self._stream_id}, count=self.max_size
+                )
+        except Exception as e:
+            LOGGER.error(f"Can not read the shared semantic cache: {e}")
+            return
+        added = 0
+        with self._lock:
+            for _, entries in streams:
+                for stream_id, fields in entries:
+                    self._stream_id = stream_id
+                    if fields[b"origin"].decode() == self._origin:
+                        continue
+                    self._add_entry(
+                        question=fields[b"question"].decode("utf-8"),
+                        embedding=np.frombuffer(fields[b"embedding"], dtype=np.float32),
+                        answer=fields[b"answer"].decode("utf-8"),
+                        version=fields[b"version"].decode("utf-8"),
+                        create_time=float(fields[b"create_time"]),
+                    )
+                    added += 1
+            if added:
+                self._evict()
+        if added:
+            LOGGER.info(f"Add {added} answers cached by other workers.")
+
+    def refresh_version(self, force: bool = False) -> str:
+        """
+        Re-read the ingestion version of the table, at most every `version_interval` seconds.
+
+        Args:
+            force (bool): Read the version even if the interval has not passed. Defaults to False.
+
+        Returns:
+            str: The current ingestion version.
+        """
+        now = time.monotonic()
+        if force or self._version is None or now - self._version_time > self.version_interval:
+            version = self.pgvec_db.version()
+            if version != self._version:
+                LOGGER.info(f"Ingestion version of '{self.table_name}' is '{version}'.")
+            self._version = version
+            self._version_time = now
+        self._sync()
+        return self._version
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _evict(self) -> None:
+        now = time.time()
+        stale = [
+            entry_id
+            for entry_id, entry in self._entries.items()
+            if entry["version"] != self._version
+            or entry["table_name"] != self.table_name
+            or now - entry["create_time"] > self.ttl
+        ]
+        for entry_id in stale:
+            del self._entries[entry_id]
+        removed = len(stale)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            removed += 1
+        if removed:
+            self.evictions += removed
+            self._matrix = None
+
+    def _index(self) -> Optional[np.ndarray]:
+        if self._matrix is None and self._entries:
+            self._matrix_ids = list(self._entries.keys())
+            self._matrix = np.stack(
+                [self._entries[entry_id]["embedding"] for entry_id in self._matrix_ids]
+            )
+        return self._matrix
+
+    def lookup(self, embedding: List[float]) -> Optional[str]:
+        """
+        Get the cached answer of the nearest question.
+
+        Args:
+            embedding (List[float]): Embedding of the new question.
+
+        Returns:
+            Optional[str]: The cached answer, None on a miss.
+        """
+        with self._lock:
+            self._evict()
+            matrix = self._index()
+            if matrix is None:
+                self.misses += 1
+                return None
+            similarity = matrix @ self._normalize(embedding)
+            best = int(np.argmax(similarity))
+            distance = 1.0 - float(similarity[best])
+            if distance > self.threshold:
+                self.misses += 1
+                return None
+            entry = self._entries[self._matrix_ids[best]]
+            self.hits += 1
+            LOGGER.info(
+                f"Semantic cache hit. distance = {distance:.4f}, cached question = '{entry['question']}'"
+            )
+            return entry["answer"]
+
+    def _add(self, question: str, embedding: List[float], answer: str) -> Optional[dict]:
+        vector = self._normalize(embedding)
+        create_time = time.time()
+        with self._lock:
+            version = self._version
+            self._add_entry(question, vector, answer, version, create_time)
+            self._evict()
+        if self.redis is None or version is None:
+            return None
+        return {
+            "origin": self._origin,
+            "question": question,
+            "embedding": vector.tobytes(),
+            "answer": answer,
+            "version": version,
+            "create_time": create_time,
+        }
+
+    def _share(self, fields: Optional[dict]) -> None:
+        if fields is None:
+            return
+        try:
+            with timer("redis"):
+                self.redis.cursor.xadd(
+                    self.stream_key, fields, maxlen=self.max_size, approximate=True
+                )
+        except Exception as e:
+            LOGGER.error(f"Can not share a semantic cache answer: {e}")
+
+    def add(self, question: str, embedding: List[float], answer: str) -> None:
+        """
+        Cache an answer.
+
+        Args:
+            question (str): The user question.
+            embedding (List[float]): Embedding of the question.
+            answer (str): The generated answer.
+        """
+        self._share(self._add(question=question, embedding=embedding, answer=answer))
+
+    async def aadd(self, question: str, embedding: List[float], answer: str) -> None:
+        """
+        Cache an answer, the Redis stream is written in a worker thread.
+
+        Args:
+            question (str): The user question.
+            embedding (List[float]): Embedding of the question.
+            answer (str): The generated answer.
+        """
+        fields = self._add(question=question, embedding=embedding, answer=answer)
+        if fields is not None:
+            await asyncio.to_thread(self._share, fields)
+
+    def _add_entry(
+        self,
+        question: str,
+        embedding: np.ndarray,
+        answer: str,
+        version: Optional[str],
+        create_time: float,
+    ) -> None:
+        self._entries[self._next_id] = {
+            "question": question,
+            "embedding": embedding,
+            "answer": answer,
+            "table_name": self.table_name,
+            "version": version,
+            "create_time": create_time,
+        }
+        self._next_id += 1
+        self._matrix = None
+
+    def stats(self) -> dict:
+        """
+        Hit-rate metrics for monitoring.
+
+        Returns:
+            dict: Counters, hit rate and current size.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "threshold": self.threshold,
+            "table_name": self.table_name,
+            "version": self._version,
+        }
@@ -3,7 +3,22 @@
 
 
 # ------------Other---------------
-from typing import Literal
+import os
+import resource
+import threading
+import time
+from collections import defaultdict, deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import (
+    BrokenExecutor,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from contextlib import contextmanager
+from itertools import islice
+from typing import Any, Literal, Optional, Tuple
 
 # from llama_index.core import StorageContext, VectorStoreIndex
 # from core.handler.rag.document_embedding import DocumentEmb
@@ -16,9 +31,65 @@ from core.models.minillm import MinillmModel
 # from core.vec_db.faiss.main import Operator as Faiss
 # -----------Data pre-process---------------
 from core.vec_db.pgvector.data import Process as PdfPrpcess
+from core.vec_db.pgvector.data import read_and_split
 
 # ------------Load Vector DB------------------
 from core.vec_db.pgvector.main import Operator as PgvecDB
+from core.vec_db.pgvector.manifest import Manifest, file_hash
+from tools.logger import config_logger
+
+# init log
+LOGGER = config_logger(
+    log_name="vectorization.log",
+    logger_name="vectorization",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+
+def _prefetch(
+    executor: Executor,
+    fn: Callable,
+    items: Iterable,
+    window: int,
+    return_exceptions: bool = False,
+) -> Iterator[Any]:
+    """
+    Map fn over items on the executor, keeping at most `window` results ahead of the consumer.
+
+    Results are yielded in input order, so a slow consumer applies backpressure instead of
+    letting finished results pile up in memory. With `return_exceptions`, the exception of
+    a failed item is yielded in place of its result instead of being raised; once the
+    executor is broken (e.g. a worker process was killed), every remaining item yields
+    that error.
+    """
+
+    def result(future: Future) -> Any:
+        if not return_exceptions:
+            return future.result()
+        try:
+            return future.result()
+        except Exception as e:
+            return e
+
+    futures, broken = deque(), None
+    for item in items:
+        if broken is None:
+            try:
+                future = executor.submit(fn, item)
+            except BrokenExecutor as e:
+                if not return_exceptions:
+                    raise
+                broken = e
+        if broken is not None:
+            future = Future()
+            future.set_exception(broken)
+        futures.append(future)
+        if len(futures) >= window:
+            yield result(futures.popleft())
+    while futures:
+        yield result(futures.popleft())
 
 
 class VectorizationService:
@@ -28,9 +99,12 @@ class VectorizationService:
     This class provides methods to process and vectorize PDF documents and images,
     then save the vectorized data into vector databases.
 
+    Files stream through read -> split -> embed -> write in batches with bounded
+    hand-offs between the stages, so memory does not grow with the corpus.
+
     Methods:
-        run(data_folder: str, types: Literal["pdf", "img"] = "pdf") -> None:
-            Process and vectorize the data in the specified folder based on the type.
+        run(data_folder: str, full: bool = False) -> None:
+            Incrementally vectorize the data in the specified folder.
     """
 
     # def __init__(
@@ -41,6 +115,15 @@ class VectorizationService:
         text_emb_model: MinillmModel,
         table_name: str = "rag_data",
         tools: Literal["default", "ai"] = "default",
+        batch_size: int = 64,
+        max_concurrency: int = 4,
+        manifest_folder: str = "./manifest",
+        file_workers: int = 1,
+        page_workers: int = 4,
+        markdown_cache: Optional[str] = "./cache/ai_markdown.sqlite",
+        copy_chunk_size: int = 5000,
+        rebuild_index: bool = False,
+        workers: int = 0,
     ) -> None:
         """
         Initialize the VectorizationService with text embedding model.
@@ -49,40 +132,308 @@ class VectorizationService:
             text_emb_model (MinillmModel): The text embedding model.
             table_name (str): Name of the table in the vector database.
             tools (Literal["default", "ai"]): Tools used for data processing.
+            batch_size (int): Number of nodes sent to the embedding model per request. Defaults to 64.
+            max_concurrency (int): Maximum number of embedding batches in flight. Defaults to 4.
+            manifest_folder (str): Folder of the ingestion manifests, one per table. Defaults to "./manifest".
+            file_workers (int): Number of files read in parallel. Defaults to 1.
+            page_workers (int): Maximum number of PDF pages converted at the same time with the "ai" tools. Defaults to 4.
+            markdown_cache (Optional[str]): Path of the cache of the markdown generated by the "ai" tools, None disables it.
+            copy_chunk_size (int): Number of rows written per COPY transaction. Defaults to 5000.
+            rebuild_index (bool): Drop the HNSW index during the run and build it once at the end. Defaults to False.
+            workers (int): Number of processes reading and splitting files with the "default" tools, 0 reads in this process. Defaults to 0.
         """
+        if min(batch_size, max_concurrency, file_workers, page_workers, copy_chunk_size) < 1:
+            raise ValueError(
+                "batch_size, max_concurrency, file_workers, page_workers and copy_chunk_size must be greater than 0!"
+            )
+        if workers < 0:
+            raise ValueError("workers must not be negative!")
+        if workers and tools != "default":
+            # the AI reader is bound by the LLM, it already converts pages in parallel threads
+            LOGGER.warning("workers only applies to the 'default' tools, read files in this process.")
+            workers = 0
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.file_workers = file_workers
+        self.copy_chunk_size = copy_chunk_size
+        self.rebuild_index = rebuild_index
+        self.stage_times = defaultdict(float)
+        self._stage_lock = threading.Lock()
         # self.text_emb_service = DocumentEmb(model=text_emb_model)
         self.text_emb = text_emb_model
         # self.img_emb_service = ImgEmb(model=img_emb_model)
 
-        self.pdf_coverter = PdfPrpcess(tools=tools)
+        self.pdf_coverter = PdfPrpcess(
+            tools=tools, page_workers=page_workers, markdown_cache=markdown_cache
+        )
         # self.img_coverter = ImgPrpcess()
         self.pgvec_db = PgvecDB(table_name=table_name)
         # self.faiss = Faiss()
+        self.manifest = Manifest(
+            path=os.path.join(manifest_folder, f"{table_name}.sqlite"),
+            table_name=table_name,
+        )
 
-    def run(self, data_folder) -> None:
+    @contextmanager
+    def _stage(self, name: str) -> Iterator[None]:
         """
-        Process and vectorize the data in the specified folder based on the type.
+        Add the time spent in the block to the total of a pipeline stage.
 
         Args:
-            data_folder (str): Path to the folder containing data.
+            name (str): Name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_stage_time(name, time.perf_counter() - start)
+
+    def _add_stage_time(self, name: str, seconds: float) -> None:
+        with self._stage_lock:
+            self.stage_times[name] += seconds
 
-        Raises:
-            TypeError: If the operate type is not supported.
+    def _embed_batch(self, nodes: list) -> list:
         """
-        # if operate == "pdf":
-        document_splitter, document = self.pdf_coverter.run(data_folder=data_folder)
-        nodes = document_splitter.get_nodes_from_documents(document)
-        for i, node in enumerate(nodes):
-            vector = self.text_emb.run(data=node.text)
+        Embed one batch of nodes with a single request.
+
+        Args:
+            nodes (list): Nodes of the batch, `node.embedding` is filled in place.
+
+        Returns:
+            list: The same nodes.
+        """
+        with self._stage("embed"):
+            vectors = self.text_emb.run(data=[node.text for node in nodes])
+        if len(vectors) != len(nodes):
+            raise RuntimeError(
+                f"Embedding model returned {len(vectors)} vectors for {len(nodes)} texts!"
+            )
+        for node, vector in zip(nodes, vectors):
             node.embedding = vector
-            print("*" * 10, "\n")
-            print(node.text)
+        return nodes
+
+    def _split_batches(self, nodes: Iterable) -> Iterator[list]:
+        """
+        Group nodes into batches of `batch_size`, splitting lazily split documents on the way.
+
+        Args:
+            nodes (Iterable): The nodes of a file.
+
+        Yields:
+            list: One batch of nodes.
+        """
+        nodes = iter(nodes)
+        while True:
+            with self._stage("split"):
+                batch = list(islice(nodes, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def _read_file(self, path: str) -> Iterator:
+        """
+        Read and convert one file into documents.
+
+        Args:
+            path (str): Path to the file.
+
+        Returns:
+            Iterator: The nodes of the file, split lazily by the consumer.
+        """
+        with self._stage("read"):
+            _, documents = self.pdf_coverter.run(input_files=[path])
+        return self.pdf_coverter.iter_nodes(documents)
+
+    def _read_results(self, executor: Executor, paths: Iterable[str]) -> Iterator:
+        """
+        Read files ahead on the executor, in order.
+
+        With `workers`, files are read and split by `read_and_split` in worker processes.
+
+        Args:
+            executor (Executor): Thread pool, or process pool with `workers`.
+            paths (Iterable[str]): Paths of the files.
+
+        Yields:
+            The nodes of each file, or the exception it failed with.
+        """
+        if not self.workers:
+            yield from _prefetch(
+                executor=executor,
+                fn=self._read_file,
+                items=paths,
+                window=self.file_workers + 1,
+                return_exceptions=True,
+            )
+            return
+        results = _prefetch(
+            executor=executor,
+            fn=read_and_split,
+            items=paths,
+            window=self.workers + 1,
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                yield result
+                continue
+            nodes, read_time, split_time = result
+            self._add_stage_time("read", read_time)
+            self._add_stage_time("split", split_time)
+            yield nodes
+
+    def _write(self, path: str, nodes: list) -> None:
+        """
+        Write one chunk of embedded nodes of a file.
+
+        Args:
+            path (str): Path to the file the nodes belong to.
+            nodes (list): Embedded nodes.
+        """
+        # record the new ids first, so a crash before commit can clean them up on resume
+        self.manifest.set_pending(path=path, node_ids=[node.node_id for node in nodes])
+        with self._stage("write"):
+            self.pgvec_db.bulk_add(nodes=nodes, chunk_size=self.copy_chunk_size)
+
+    def _ingest_file(
+        self, path: str, digest: str, nodes: Iterable, executor: Executor
+    ) -> Tuple[int, int]:
+        """
+        Split, embed and write one file, replacing the nodes of its previous version.
+
+        Nodes stream through the stages in batches: at most `max_concurrency` batches
+        are being embedded and at most `copy_chunk_size` embedded nodes wait for the
+        write, however large the file is.
+
+        Args:
+            path (str): Path to the file.
+            digest (str): Content hash of the file.
+            nodes (Iterable): The nodes of the file.
+            executor (Executor): Executor running the embedding requests.
+
+        Returns:
+            Tuple[int, int]: Number of nodes written and number of embedding batches.
+        """
+        self.pgvec_db.delete(node_ids=self.manifest.stale_node_ids(path=path))
+        node_ids, pending, batch_count = [], [], 0
+        batches = _prefetch(
+            executor=executor,
+            fn=self._embed_batch,
+            items=self._split_batches(nodes),
+            window=self.max_concurrency,
+        )
+        for batch in batches:
+            batch_count += 1
+            node_ids.extend(node.node_id for node in batch)
+            pending.extend(batch)
+            if len(pending) >= self.copy_chunk_size:
+                self._write(path=path, nodes=pending)
+                pending = []
+        if pending:
+            self._write(path=path, nodes=pending)
+        self.manifest.commit(path=path, digest=digest, node_ids=node_ids)
+        return len(node_ids), batch_count
+
+    def run(self, data_folder, full: bool = False) -> None:
+        """
+        Incrementally vectorize the data in the specified folder.
+
+        Unchanged files are skipped, changed files replace their old nodes and the nodes
+        of removed files are deleted. Progress is checkpointed after every file, so an
+        interrupted run resumes where it stopped.
+
+        Args:
+            data_folder (str): Path to the folder containing data.
+            full (bool): Clear the table and rebuild it from scratch. Defaults to False.
+        """
+        if self.rebuild_index:
+            # building the graph once is much faster than updating it for every copied row
+            self.pgvec_db.drop_index()
+        try:
+            self._run(data_folder=data_folder, full=full)
+        finally:
+            # the AI reader's page threads do not outlive the run
+            self.pdf_coverter.close()
+            if self.rebuild_index:
+                self.pgvec_db.create_index()
+        # no-op once built, the hybrid retrieval only reads it
+        self.pgvec_db.create_text_index()
+        # indexes the codes of a table loaded before the code table existed, queries only read it
+        self.pgvec_db.create_code_index()
+
+    def _run(self, data_folder, full: bool) -> None:
+        start = time.perf_counter()
+        if full:
+            LOGGER.info("Full rebuild, clear table and manifest.")
+            self.pgvec_db.clear()
+            self.manifest.clear()
+        elif self.manifest.is_empty() and self.pgvec_db.count() > 0:
+            LOGGER.warning(
+                "Table has rows which are not tracked by the manifest, use full rebuild to avoid duplicates."
+            )
+
+        files = self.pdf_coverter.list_files(data_folder=data_folder)
+        for path in set(self.manifest.files()) - set(files):
+            self.pgvec_db.delete(node_ids=self.manifest.stale_node_ids(path=path))
+            self.manifest.remove(path=path)
+            LOGGER.info(f"Removed nodes of deleted file '{path}'.")
+
+        changed = []
+        for path in files:
+            digest = file_hash(path)
+            if not self.manifest.is_unchanged(path=path, digest=digest):
+                changed.append((path, digest))
+        skipped, node_count, batch_count, failed = len(files) - len(changed), 0, 0, []
 
-        # elif operate == "img":
-        #     dataset = self.img_coverter.run(data_folder=data_folder)
-        #     dataset_emb = self.img_emb_service.run(dataset=dataset)
-        #     self.faiss.save(dataset=dataset_emb)
+        self.stage_times = defaultdict(float)
+        read_executor = (
+            ProcessPoolExecutor(max_workers=self.workers)
+            if self.workers
+            else ThreadPoolExecutor(max_workers=self.file_workers)
+        )
+        # files are read ahead in parallel, splitting, embedding and writing stay in order
+        with read_executor, ThreadPoolExecutor(
+            max_workers=self.max_concurrency
+        ) as embed_executor:
+            results = self._read_results(
+                executor=read_executor, paths=(path for path, _ in changed)
+            )
+            for i, ((path, digest), nodes) in enumerate(zip(changed, results)):
+                if isinstance(nodes, Exception):
+                    # not committed to the manifest, the file is retried by the next run
+                    failed.append(path)
+                    LOGGER.error(
+                        f"[{i + 1}/{len(changed)}] Failed to read '{path}', skipped: {nodes!r}"
+                    )
+                    continue
+                file_start = time.perf_counter()
+                count, batches = self._ingest_file(
+                    path=path, digest=digest, nodes=nodes, executor=embed_executor
+                )
+                node_count += count
+                batch_count += batches
+                elapsed = max(time.perf_counter() - start, 1e-9)
+                LOGGER.info(
+                    f"[{i + 1}/{len(changed)}] Ingested '{path}': {count} nodes in "
+                    f"{time.perf_counter() - file_start:.2f}s, total {node_count} nodes "
+                    f"({node_count / elapsed:.1f} nodes/s, {batch_count / elapsed:.2f} batches/s)."
+                )
+        ingested = len(changed) - len(failed)
 
-        # else:
-        #     raise TypeError("Not support data type!")
-        self.pgvec_db.add(nodes=nodes)
+        # read and embed run in parallel workers, their totals can exceed the wall time
+        stages = ", ".join(
+            f"{name} {self.stage_times[name]:.2f}s"
+            for name in ("read", "split", "embed", "write")
+        )
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        LOGGER.info(
+            f"Vectorization finished in {elapsed:.2f}s. "
+            f"{ingested} files ingested ({node_count} nodes in {batch_count} batches, "
+            f"{node_count / elapsed:.1f} nodes/s, {batch_count / elapsed:.2f} batches/s, "
+            f"batch_size={self.batch_size}, max_concurrency={self.max_concurrency}), "
+            f"{skipped} unchanged files skipped, {len(failed)} files failed. "
+            f"Stage time: {stages}. Peak memory: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB."
+        )
+        if failed:
+            LOGGER.warning(f"Files which failed and are retried by the next run: {failed}")
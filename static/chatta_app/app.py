@@ -1,3 +1,4 @@
+import logging
 import os
 
 import httpx
@@ -11,6 +12,8 @@ from handler import RagHandler
 # Visit Github Repository: [p513817/ollama-streamlit](https://github.com/p513817/ollama-streamlit)
 # """
 
+logging.basicConfig(level=logging.INFO)
+
 # Init
 if "USER_LOGIN" not in st.session_state:
     st.session_state.USER_LOGIN = False
@@ -100,8 +103,8 @@ def main():
         # Display assistant response in chat message container
         with st.chat_message("assistant"):
             try:
-                response = st.write(
-                    RAG.chat(
+                response = st.write_stream(
+                    RAG.stream_chat(
                         username=st.session_state.USER_NAME,
                         department=st.session_state.USER_DEPT,
                         prompt=prompt,
@@ -1,16 +1,24 @@
 import json
+import logging
+import time
+from collections.abc import Generator
 
 import httpx
-from utils.chat import get_rag_route
+from utils.chat import get_rag_route, get_rag_stream_route
 from utils.connect import get_rag_host, get_rag_port
 
+LOGGER = logging.getLogger("rag_handler")
+
 
 class RagHandler:
     def __init__(self) -> None:
         self.host = get_rag_host()
         self.port = get_rag_port()
         self.chat_api = get_rag_route(self.host, self.port)
+        self.chat_stream_api = get_rag_stream_route(self.host, self.port)
         self.current_messages = []
+        self.span_id = None
+        self.retrieval = []
 
     def chat(self, username: str, department: str, prompt: str):
         params = {"username": username.lower(), "department": department.lower()}
@@ -38,6 +46,54 @@ class RagHandler:
                     f"Unexpected response status code: {response.status_code}"
                 )
 
+    def stream_chat(
+        self, username: str, department: str, prompt: str
+    ) -> Generator[str]:
+        """Yield answer tokens from the Server-Sent Events endpoint as they arrive."""
+        params = {"username": username.lower(), "department": department.lower()}
+        form_data = {"prompt": prompt}
+        self.span_id = None
+        self.retrieval = []
+
+        start = time.perf_counter()
+        first_token = True
+        with httpx.stream(
+            "POST",
+            self.chat_stream_api,
+            params=params,
+            data=form_data,
+            timeout=httpx.Timeout(30, read=None),
+            follow_redirects=True,
+        ) as response:
+            if response.status_code != 200:
+                raise ValueError(
+                    f"Unexpected response status code: {response.status_code}"
+                )
+            if not response.headers.get("content-type", "").startswith(
+                "text/event-stream"
+            ):
+                # e.g. user not registered, server answers with plain json
+                yield json.loads(response.read())["message"]
+                return
+
+            event = None
+            for line in response.iter_lines():
+                if line.startswith("event:"):
+                    event = line[len("event:") :].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:") :])
+                    if event == "token":
+                        if first_token:
+                            first_token = False
+                            LOGGER.info(
+                                f"Time to first token : {time.perf_counter() - start:.3f}s"
+                            )
+                        yield data["token"]
+                    elif event == "end":
+                        self.span_id = data.get("span_id")
+                        self.retrieval = data.get("retrieval", [])
+        LOGGER.info(f"Stream finished : {time.perf_counter() - start:.3f}s")
+
     # def stream_chat(self) -> Generator[str] | None:
     #     if self.current_messages == []:
     #         print("There is no current messages")
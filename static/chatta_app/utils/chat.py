@@ -37,3 +37,9 @@ def get_rag_route(host: str, port: int) -> str:
     if not is_valid_ip(host):
         raise TypeError("Httpx only support regular IP address, like AAA.BBB.CCC.DDD")
     return f"http://{host}:{port}/chat"
+
+
+def get_rag_stream_route(host: str, port: int) -> str:
+    if not is_valid_ip(host):
+        raise TypeError("Httpx only support regular IP address, like AAA.BBB.CCC.DDD")
+    return f"http://{host}:{port}/chat/stream/"
@@ -0,0 +1,65 @@
+"""
+Compare per-request latency of a fresh httpx client against the shared HttpPool.
+
+Usage:
+    python3 -m tools.http_benchmark --host 10.204.16.75 --port 11434 -n 200
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, List
+
+import httpx
+
+from core.models.client import HttpPool
+
+
+def _measure(send: Callable[[], httpx.Response], requests: int) -> List[float]:
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = send()
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def _report(name: str, latencies: List[float]) -> None:
+    latencies = sorted(latencies)
+    p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)]
+    print(
+        f"{name:<12} n={len(latencies)} mean={statistics.mean(latencies):.2f}ms "
+        f"p50={statistics.median(latencies):.2f}ms p95={p95:.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP connection pool benchmark.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", default="11434")
+    parser.add_argument("--model", default="all-minilm:latest")
+    parser.add_argument("-n", "--requests", default=100, type=int)
+    args = parser.parse_args()
+
+    url = f"http://{args.host}:{args.port}/api/embed"
+    payload = {"model": args.model, "input": "what is EGPS-3401"}
+
+    def fresh_client() -> httpx.Response:
+        with httpx.Client() as client:
+            return client.post(url=url, json=payload, timeout=None)
+
+    pool = HttpPool()
+
+    def pooled_client() -> httpx.Response:
+        return pool.client.post(url=url, json=payload)
+
+    # warm up the model so the first measurement does not include model loading
+    pooled_client()
+    _report("per-request", _measure(fresh_client, args.requests))
+    _report("pooled", _measure(pooled_client, args.requests))
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
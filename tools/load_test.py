@@ -0,0 +1,197 @@
+"""
+Load test of the chat endpoints, to compare throughput across worker counts.
+
+Every client is a registered user which sends questions one after another for
+`--duration` seconds; the test runs once per concurrency level. Questions come
+from a text file (one per line) or a retrieval_eval JSONL file ("question" field).
+Runs are appended to `--output` with their `--label`, `--report` prints them side by side:
+
+    WEB_CONCURRENCY=1 ... python3 -m tools.load_test -c 1 4 16 --label workers=1 -o runs.jsonl
+    WEB_CONCURRENCY=4 ... python3 -m tools.load_test -c 1 4 16 --label workers=4 -o runs.jsonl
+    python3 -m tools.load_test --report runs.jsonl
+
+Usage:
+    python3 -m tools.load_test --url http://127.0.0.1:8000 -c 1 4 16 -d 60 --stream
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import defaultdict
+from typing import List, Optional
+
+import httpx
+
+DEFAULT_QUESTIONS = [
+    "what is EGPS-3401",
+    "What is the max power of EGPU-3201?",
+    "Which operating systems does EMUC-B2S3 support?",
+    "What is the operating temperature of 3ME3?",
+]
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _load_questions(path: Optional[str]) -> List[str]:
+    if path is None:
+        return DEFAULT_QUESTIONS
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            questions.append(json.loads(line)["question"] if line.startswith("{") else line)
+    return questions
+
+
+async def _register(client: httpx.AsyncClient, users: List[tuple]) -> None:
+    for username, department in users:
+        response = await client.post(
+            "/submit/", params={"username": username, "department": department}
+        )
+        response.raise_for_status()
+
+
+async def _ask(
+    client: httpx.AsyncClient, user: tuple, question: str, stream: bool
+) -> Optional[float]:
+    """
+    Send one question.
+
+    Returns:
+        Optional[float]: Seconds to the first token when streaming, None otherwise.
+    """
+    params = {"username": user[0], "department": user[1]}
+    data = {"prompt": question}
+    if not stream:
+        response = await client.post("/chat/", params=params, data=data)
+        response.raise_for_status()
+        if "message" not in response.json():
+            raise RuntimeError(response.text)
+        return None
+    start = time.perf_counter()
+    first_token = None
+    async with client.stream("POST", "/chat/stream/", params=params, data=data) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if first_token is None and line.startswith("event: token"):
+                first_token = time.perf_counter() - start
+    return first_token
+
+
+async def _run_level(
+    client: httpx.AsyncClient,
+    users: List[tuple],
+    questions: List[str],
+    duration: float,
+    stream: bool,
+) -> dict:
+    latencies, ttfts, errors = [], [], defaultdict(int)
+    deadline = time.perf_counter() + duration
+
+    async def worker(index: int) -> None:
+        n = index
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                ttft = await _ask(client, users[index], questions[n % len(questions)], stream)
+            except Exception as e:
+                errors[type(e).__name__] += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+                if ttft is not None:
+                    ttfts.append(ttft)
+            n += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(index) for index in range(len(users))))
+    elapsed = time.perf_counter() - start
+    result = {
+        "concurrency": len(users),
+        "requests": len(latencies),
+        "errors": dict(errors),
+        "throughput": len(latencies) / elapsed,
+        **{f"p{q}": _percentile(latencies, q / 100) for q in (50, 95, 99)},
+    }
+    if stream:
+        result.update({f"ttft_p{q}": _percentile(ttfts, q / 100) for q in (50, 95)})
+    return result
+
+
+def _print_result(result: dict) -> None:
+    line = (
+        f"c={result['concurrency']:<4} n={result['requests']:<6} "
+        f"{result['throughput']:.2f} req/s  p50={result['p50']:.2f}s "
+        f"p95={result['p95']:.2f}s p99={result['p99']:.2f}s"
+    )
+    if "ttft_p50" in result:
+        line += f"  ttft p50={result['ttft_p50']:.2f}s p95={result['ttft_p95']:.2f}s"
+    if result["errors"]:
+        line += f"  errors={result['errors']}"
+    print(line)
+
+
+def _report(path: str) -> None:
+    throughput = defaultdict(dict)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            run = json.loads(line)
+            throughput[run["label"]][run["concurrency"]] = run["throughput"]
+    levels = sorted({level for runs in throughput.values() for level in runs})
+    print("req/s".ljust(16) + "".join(f"c={level}".rjust(10) for level in levels))
+    for label, runs in throughput.items():
+        print(
+            label.ljust(16)
+            + "".join(
+                (f"{runs[level]:.2f}" if level in runs else "-").rjust(10) for level in levels
+            )
+        )
+
+
+async def _main(args) -> None:
+    questions = _load_questions(args.questions)
+    timeout = httpx.Timeout(connect=10.0, read=None, write=60.0, pool=None)
+    limits = httpx.Limits(max_connections=max(args.concurrency) + 4)
+    async with httpx.AsyncClient(base_url=args.url, timeout=timeout, limits=limits) as client:
+        users = [(f"load_test_{i}", args.department) for i in range(max(args.concurrency))]
+        await _register(client, users)
+        for level in args.concurrency:
+            result = await _run_level(
+                client, users[:level], questions, args.duration, args.stream
+            )
+            result["label"] = args.label
+            _print_result(result)
+            if args.output:
+                with open(args.output, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(result) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the chat endpoints.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("-c", "--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("-d", "--duration", default=60.0, type=float, help="Seconds per concurrency level.")
+    parser.add_argument("-q", "--questions", default=None, help="Text file or retrieval_eval JSONL.")
+    parser.add_argument("--stream", action="store_true", help="Use /chat/stream/ and measure time to first token.")
+    parser.add_argument("--department", default="load_test")
+    parser.add_argument("--label", default=f"workers={os.environ.get('WEB_CONCURRENCY', '1')}")
+    parser.add_argument("-o", "--output", default=None, help="JSONL file the results are appended to.")
+    parser.add_argument("--report", default=None, help="Print the throughput of the runs saved in a JSONL file.")
+    args = parser.parse_args()
+
+    if args.report:
+        _report(args.report)
+        return
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
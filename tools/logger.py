@@ -0,0 +1,233 @@
+import atexit
+import hashlib
+import logging
+import multiprocessing.util
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Literal, Optional
+
+try:
+    import colorlog
+except ImportError:  # plain console output without colorlog
+    colorlog = None
+
+PayloadMode = Literal["full", "truncate", "hash"]
+
+LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+    "critical": logging.CRITICAL,
+}
+FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# size-based rotation of every log file, 0 disables it
+MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "5"))
+# forces the write mode of every log file, "a" when several workers share the files
+WRITE_MODE = os.environ.get("LOG_WRITE_MODE")
+
+
+class _RouterHandler(logging.Handler):
+    """
+    Hand every record to the handlers of the logger which emitted it.
+
+    Runs on the listener thread, so the files are written off the request threads.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._routes: Dict[str, List[logging.Handler]] = {}
+        self._route_lock = threading.Lock()
+
+    def add_route(self, logger_name: str, handlers: List[logging.Handler]) -> None:
+        with self._route_lock:
+            self._routes[logger_name] = handlers
+
+    def handlers(self, logger_name: str) -> List[logging.Handler]:
+        with self._route_lock:
+            return list(self._routes.get(logger_name, ()))
+
+    def emit(self, record: logging.LogRecord) -> None:
+        for handler in self._routes.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+class _Backend:
+    """
+    One queue and one listener thread shared by all the loggers of the process.
+    """
+
+    def __init__(self) -> None:
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.router = _RouterHandler()
+        self.console = self._console_handler()
+        handlers = [self.router] + ([self.console] if self.console else [])
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.stop)
+        if hasattr(os, "register_at_fork"):
+            # a forked worker has the queue but not the listener thread
+            os.register_at_fork(after_in_child=self._restart)
+        # multiprocessing workers leave with os._exit, atexit never runs there
+        multiprocessing.util.register_after_fork(self, _Backend._stop_at_exit)
+
+    @staticmethod
+    def _console_handler() -> Optional[logging.Handler]:
+        if os.environ.get("LOG_CONSOLE", "1") != "1":
+            return None
+        handler = logging.StreamHandler()
+        if colorlog is not None:
+            handler.setFormatter(colorlog.ColoredFormatter("%(log_color)s" + FORMAT))
+        else:
+            handler.setFormatter(logging.Formatter(FORMAT))
+        handler.setLevel(LEVELS.get(os.environ.get("LOG_CONSOLE_LEVEL", "info"), logging.INFO))
+        return handler
+
+    def _restart(self) -> None:
+        self.queue = queue.SimpleQueue()
+        for logger in logging.Logger.manager.loggerDict.values():
+            for handler in getattr(logger, "handlers", ()):
+                if isinstance(handler, QueueHandler):
+                    handler.queue = self.queue
+        self.listener = QueueListener(
+            self.queue, *self.listener.handlers, respect_handler_level=True
+        )
+        self.listener.start()
+
+    @staticmethod
+    def _stop_at_exit(backend: "_Backend") -> None:
+        multiprocessing.util.Finalize(backend, backend.stop, exitpriority=0)
+
+    def stop(self) -> None:
+        # drain the queue before the process exits
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+
+_BACKEND: Optional[_Backend] = None
+_BACKEND_LOCK = threading.Lock()
+
+
+def _backend() -> _Backend:
+    global _BACKEND
+    with _BACKEND_LOCK:
+        if _BACKEND is None:
+            _BACKEND = _Backend()
+        return _BACKEND
+
+
+def config_logger(
+    log_name: str,
+    logger_name: str,
+    default_folder: str = "./log",
+    write_mode: str = "w",
+    level: str = "debug",
+) -> logging.Logger:
+    """
+    Get a logger writing to `<default_folder>/<log_name>` and the console, without blocking.
+
+    Records are put in a queue shared by all loggers; one listener thread formats
+    and writes them, so a request thread never waits for the disk. The file rotates
+    when it reaches LOG_MAX_BYTES, keeping LOG_BACKUP_COUNT old files. Configuring
+    the same logger name again returns the existing logger. LOG_WRITE_MODE, when
+    set, overrides `write_mode` for every logger.
+
+    Args:
+        log_name (str): Name of the log file.
+        logger_name (str): Name of the logger.
+        default_folder (str): Folder of the log file. Defaults to "./log".
+        write_mode (str): "w" empties the file first, "a" appends to it. Defaults to "w".
+        level (str): "debug", "info", "warning", "error" or "critical". Defaults to "debug".
+
+    Returns:
+        logging.Logger: The logger.
+    """
+    backend = _backend()
+    logger = logging.getLogger(logger_name)
+    if any(isinstance(handler, QueueHandler) for handler in logger.handlers):
+        return logger
+
+    os.makedirs(default_folder, exist_ok=True)
+    path = os.path.join(default_folder, log_name)
+    write_mode = WRITE_MODE or write_mode
+    if write_mode == "w":
+        # RotatingFileHandler always appends once rotation is on
+        open(path, "w").close()
+    file_handler = RotatingFileHandler(
+        path, mode="a", maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT, encoding="utf-8", delay=True
+    )
+    file_handler.setFormatter(logging.Formatter(FORMAT))
+    backend.router.add_route(logger_name, [file_handler])
+
+    logger.setLevel(LEVELS.get(level.lower(), logging.DEBUG))
+    logger.addHandler(QueueHandler(backend.queue))
+    logger.propagate = False
+    return logger
+
+
+def close_logger_files(logger_name: str) -> None:
+    """
+    Close the log files of a logger to free their handles.
+
+    The logger stays usable: its next record reopens the files in append mode.
+
+    Args:
+        logger_name (str): Name of the logger.
+    """
+    for handler in _backend().router.handlers(logger_name):
+        handler.close()
+
+
+_PAYLOAD_MODE: PayloadMode = os.environ.get("LOG_PAYLOAD", "full")
+_PAYLOAD_LIMIT = int(os.environ.get("LOG_PAYLOAD_LIMIT", "200"))
+
+
+def set_payload_mode(mode: PayloadMode, limit: int = 200) -> None:
+    """
+    Choose how payload() logs long texts.
+
+    Args:
+        mode (PayloadMode): "full" keeps the text, "truncate" keeps its first `limit` characters, "hash" keeps a digest.
+        limit (int): Length above which a text is truncated or hashed. Defaults to 200.
+    """
+    global _PAYLOAD_MODE, _PAYLOAD_LIMIT
+    if mode not in ("full", "truncate", "hash"):
+        raise ValueError(f"Unknown payload mode '{mode}'!")
+    _PAYLOAD_MODE, _PAYLOAD_LIMIT = mode, limit
+
+
+def payload(value) -> str:
+    """
+    Text of a logged payload (prompt, retrieval, answer) in the configured LOG_PAYLOAD mode.
+
+    Args:
+        value: The payload, converted with str().
+
+    Returns:
+        str: The full text, its truncation or its digest.
+    """
+    text = str(value)
+    if _PAYLOAD_MODE == "full" or len(text) <= _PAYLOAD_LIMIT:
+        return text
+    if _PAYLOAD_MODE == "truncate":
+        return f"{text[:_PAYLOAD_LIMIT]}...(+{len(text) - _PAYLOAD_LIMIT} chars)"
+    digest = hashlib.sha1(text.encode("utf-8", "replace")).hexdigest()[:16]
+    return f"<sha1:{digest} len={len(text)}>"
+
+
+if __name__ == "__main__":
+    log = config_logger(
+        log_name="example.log",
+        logger_name="example",
+        default_folder="./log",
+        write_mode="w",
+        level="debug",
+    )
+    log.info("Hello!")
+    set_payload_mode("hash")
+    log.debug(f"Prompt: {payload('x' * 1000)}")
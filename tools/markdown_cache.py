@@ -0,0 +1,232 @@
+"""
+On-disk cache of the markdown the LLM generates for each PDF page.
+
+Usage:
+    python3 -m tools.markdown_cache stats
+    python3 -m tools.markdown_cache list -n 20
+    python3 -m tools.markdown_cache prune --max_mb 256
+    python3 -m tools.markdown_cache clear
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+DEFAULT_PATH = "./cache/ai_markdown.sqlite"
+
+
+class MarkdownCache:
+    """
+    SQLite cache of generated markdown, keyed by hash of (page text, system prompt, user template, model name).
+
+    Entries are evicted least recently used first once the cache grows over
+    `max_entries` or `max_bytes`. Safe to share between the page worker threads.
+
+    Attributes:
+        path (str): Path to the SQLite file.
+        max_entries (Optional[int]): Maximum number of pages, None for no limit.
+        max_bytes (Optional[int]): Maximum total size of the markdown, None for no limit.
+
+    Methods:
+        key(text: str, system_prompt: str, user_template: str, model_name: str) -> str:
+            Build the cache key of a page.
+
+        get(key: str) -> Optional[str]:
+            Get the cached markdown.
+
+        put(key: str, markdown: str) -> None:
+            Cache the markdown of a page.
+
+        prune(max_entries: Optional[int] = None, max_bytes: Optional[int] = None) -> int:
+            Evict least recently used pages until the limits hold.
+
+        stats() -> dict:
+            Size and hit counters of the cache.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_PATH,
+        max_entries: Optional[int] = 100000,
+        max_bytes: Optional[int] = 1 << 30,
+    ) -> None:
+        """
+        Initialize the MarkdownCache, creating the SQLite file if it does not exist.
+
+        Args:
+            path (str): Path to the SQLite file. Defaults to "./cache/ai_markdown.sqlite".
+            max_entries (Optional[int]): Maximum number of pages. Defaults to 100000.
+            max_bytes (Optional[int]): Maximum total size of the markdown. Defaults to 1 GiB.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, markdown TEXT, size INTEGER, create_time REAL, access_time REAL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS pages_access_idx ON pages (access_time)"
+            )
+        self._entries, self._bytes = self._totals()
+
+    def _totals(self) -> Tuple[int, int]:
+        count, size = self._conn.execute(
+            "SELECT count(*), coalesce(sum(size), 0) FROM pages"
+        ).fetchone()
+        return count, size
+
+    @staticmethod
+    def key(text: str, system_prompt: str, user_template: str, model_name: str) -> str:
+        digest = hashlib.sha256()
+        for part in (text, system_prompt, user_template, model_name):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT markdown FROM pages WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE pages SET access_time = ? WHERE key = ?", (time.time(), key)
+                )
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, markdown: str) -> None:
+        size = len(markdown.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM pages WHERE key = ?", (key,)
+            ).fetchone()
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                    (key, markdown, size, now, now),
+                )
+            if old is None:
+                self._entries += 1
+            self._bytes += size - (old[0] if old else 0)
+            over_entries = self.max_entries is not None and self._entries > self.max_entries
+            over_bytes = self.max_bytes is not None and self._bytes > self.max_bytes
+        if over_entries or over_bytes:
+            self.prune()
+
+    def prune(
+        self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None
+    ) -> int:
+        """
+        Evict least recently used pages until the limits hold.
+
+        Args:
+            max_entries (Optional[int]): Maximum number of pages, defaults to the cache limit.
+            max_bytes (Optional[int]): Maximum total size of the markdown, defaults to the cache limit.
+
+        Returns:
+            int: Number of evicted pages.
+        """
+        max_entries = self.max_entries if max_entries is None else max_entries
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        with self._lock:
+            entries, total = self._totals()
+            rows = self._conn.execute(
+                "SELECT key, size FROM pages ORDER BY access_time"
+            ).fetchall()
+            keys: List[str] = []
+            for key, size in rows:
+                if (max_entries is None or entries <= max_entries) and (
+                    max_bytes is None or total <= max_bytes
+                ):
+                    break
+                keys.append(key)
+                entries -= 1
+                total -= size
+            with self._conn:
+                self._conn.executemany(
+                    "DELETE FROM pages WHERE key = ?", ((key,) for key in keys)
+                )
+            evicted = len(keys)
+            self._entries, self._bytes = self._totals()
+        return evicted
+
+    def clear(self) -> None:
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM pages")
+            self._entries, self._bytes = 0, 0
+        self._conn.execute("VACUUM")
+
+    def entries(self, limit: int = 20) -> List[tuple]:
+        return self._conn.execute(
+            "SELECT key, size, create_time, access_time FROM pages ORDER BY access_time DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "entries": self._entries,
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or prune the AI markdown cache.")
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="show the size of the cache.")
+    list_parser = commands.add_parser("list", help="list the most recently used pages.")
+    list_parser.add_argument("-n", "--limit", default=20, type=int)
+    prune_parser = commands.add_parser("prune", help="evict least recently used pages.")
+    prune_parser.add_argument("--max_entries", type=int)
+    prune_parser.add_argument("--max_mb", type=float)
+    commands.add_parser("clear", help="delete every page.")
+    args = parser.parse_args()
+
+    cache = MarkdownCache(path=args.path, max_entries=None, max_bytes=None)
+    if args.command == "stats":
+        stats = cache.stats()
+        print(f"{stats['entries']} pages, {stats['bytes'] / (1 << 20):.2f} MiB in '{stats['path']}'")
+    elif args.command == "list":
+        for key, size, create_time, access_time in cache.entries(limit=args.limit):
+            print(
+                f"{key[:16]}  {size:>8} B  created {time.ctime(create_time)}  used {time.ctime(access_time)}"
+            )
+    elif args.command == "prune":
+        max_bytes = int(args.max_mb * (1 << 20)) if args.max_mb is not None else None
+        evicted = cache.prune(max_entries=args.max_entries, max_bytes=max_bytes)
+        print(f"Evicted {evicted} pages.")
+    elif args.command == "clear":
+        cache.clear()
+        print("Cleared the cache.")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
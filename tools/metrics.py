@@ -0,0 +1,197 @@
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Sequence
+
+# seconds, from a cache hit to a long generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """
+    Latency histogram with cumulative buckets and quantiles over the latest observations.
+
+    Attributes:
+        buckets (Sequence[float]): Upper bounds of the buckets, in seconds.
+        count (int): Number of observations.
+        total (float): Sum of the observations.
+
+    Methods:
+        observe(value: float) -> None:
+            Record an observation.
+
+        quantile(q: float) -> float:
+            The q-quantile of the latest observations.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, window: int = 1024) -> None:
+        """
+        Initialize the Histogram.
+
+        Args:
+            buckets (Sequence[float]): Upper bounds of the buckets, in seconds. Defaults to DEFAULT_BUCKETS.
+            window (int): Number of latest observations the quantiles are computed on. Defaults to 1024.
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._window = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self._window.append(value)
+
+    def quantile(self, q: float) -> float:
+        if not self._window:
+            return 0.0
+        values = sorted(self._window)
+        # nearest rank
+        return values[min(len(values) - 1, max(0, round(q * len(values)) - 1))]
+
+    def cumulative(self) -> Iterator[tuple]:
+        running = 0
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            running += count
+            yield bound, running
+        yield float("inf"), self.count
+
+
+class StageMetrics:
+    """
+    Per-stage latency histograms of the RAG pipeline, rendered in the Prometheus text format.
+
+    Stages are free names, e.g. "embed_query", "vector_search", "prompt_render",
+    "ttft", "generation" or "redis". The metrics live in the process; with several
+    workers each one exposes its own.
+
+    Methods:
+        observe(stage: str, seconds: float) -> None:
+            Record the duration of a stage.
+
+        timer(stage: str) -> ContextManager:
+            Time the wrapped block as a stage.
+
+        summary() -> dict:
+            Count, mean and p50/p95/p99 per stage.
+
+        render() -> str:
+            All stages in the Prometheus text exposition format.
+    """
+
+    def __init__(
+        self,
+        namespace: str = "rag",
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        window: int = 1024,
+    ) -> None:
+        """
+        Initialize the StageMetrics.
+
+        Args:
+            namespace (str): Prefix of the metric names. Defaults to "rag".
+            buckets (Sequence[float]): Upper bounds of the histogram buckets, in seconds.
+            window (int): Number of latest observations per stage the quantiles are computed on. Defaults to 1024.
+        """
+        self.namespace = namespace
+        self.buckets = buckets
+        self.window = window
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets, self.window)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """
+        Time the wrapped block as a stage, also when it raises.
+
+        Args:
+            stage (str): Name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                stage: {
+                    "count": histogram.count,
+                    "mean": histogram.total / histogram.count,
+                    **{f"p{round(q * 100)}": histogram.quantile(q) for q in QUANTILES},
+                }
+                for stage, histogram in self._histograms.items()
+            }
+
+    @staticmethod
+    def _number(value: float) -> str:
+        return "+Inf" if value == float("inf") else repr(float(value))
+
+    def render(self) -> str:
+        name = f"{self.namespace}_stage_duration_seconds"
+        lines = [
+            f"# HELP {name} Duration of the RAG pipeline stages.",
+            f"# TYPE {name} histogram",
+        ]
+        quantile_lines = [
+            f"# HELP {name}_quantile Quantiles of the latest {self.window} durations per stage.",
+            f"# TYPE {name}_quantile summary",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                for bound, count in histogram.cumulative():
+                    lines.append(
+                        f'{name}_bucket{{stage="{stage}",le="{self._number(bound)}"}} {count}'
+                    )
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.total!r}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+                for q in QUANTILES:
+                    quantile_lines.append(
+                        f'{name}_quantile{{stage="{stage}",quantile="{q}"}} {histogram.quantile(q)!r}'
+                    )
+                quantile_lines.append(f'{name}_quantile_sum{{stage="{stage}"}} {histogram.total!r}')
+                quantile_lines.append(f'{name}_quantile_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines + quantile_lines) + "\n"
+
+
+# shared by the whole process
+METRICS = StageMetrics()
+
+
+def timer(stage: str, metrics: Optional[StageMetrics] = None):
+    """
+    Time the wrapped block as a stage of the process metrics.
+
+    Args:
+        stage (str): Name of the stage.
+        metrics (Optional[StageMetrics]): Metrics to record to, None uses METRICS.
+    """
+    return (metrics or METRICS).timer(stage)
+
+
+def observe(stage: str, seconds: float, metrics: Optional[StageMetrics] = None) -> None:
+    (metrics or METRICS).observe(stage, seconds)
+
+
+if __name__ == "__main__":
+    import random
+
+    for _ in range(200):
+        with timer("embed_query"):
+            time.sleep(random.random() / 1000)
+    observe("generation", 1.2)
+    print(METRICS.summary())
+    print(METRICS.render())
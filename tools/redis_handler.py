@@ -1,8 +1,11 @@
 import json
 import os
+from typing import Optional
 
 import redis
 
+from tools.metrics import timer
+
 
 class RedisNotifier:
     def __init__(
@@ -26,26 +29,45 @@ class RedisNotifier:
         cursor = redis.Redis(host=self.host, port=self.port, password=self.password)
         return cursor
 
-    def send(self, message: str):
+    def send(self, message: str, key: Optional[str] = None, expire: Optional[int] = None):
         """
         Save message to redis.
 
         Args:
             message (str): Information.
+            key (Optional[str]): Key to write, defaults to the notifier keyword.
+            expire (Optional[int]): Seconds before the key expires, None keeps it forever.
         """
-        self.cursor.set(self.keyword, message)
+        with timer("redis"):
+            self.cursor.set(key or self.keyword, message, ex=expire)
         # self.cursor.lpush(self.keyword, message)
 
         # print(message, flush=True)
 
-    def get_value(self):
+    def get_value(self, key: Optional[str] = None):
         """
         Get value from redis.
 
+        Args:
+            key (Optional[str]): Key to read, defaults to the notifier keyword.
+
         Returns:
             redis: value from redis.
         """
-        return self.cursor.get(self.keyword)
+        with timer("redis"):
+            return self.cursor.get(key or self.keyword)
+
+    def set_value(self, key: str, value, expire: Optional[int] = None):
+        """
+        Save value to redis under a key.
+
+        Args:
+            key (str): Key to write.
+            value: Value to save.
+            expire (Optional[int]): Seconds before the key expires, None keeps it forever.
+        """
+        with timer("redis"):
+            self.cursor.set(key, value, ex=expire)
 
     def close(self):
         """
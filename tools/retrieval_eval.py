@@ -0,0 +1,99 @@
+"""
+Compare latency and recall of the retrieval modes.
+
+The eval set is a JSONL file, one question per line. A retrieved node is
+relevant when its file name equals "file_name" or its text contains
+"contains" (case-insensitive), whichever of the two is given:
+
+    {"question": "what is EGPS-3401", "file_name": "EGPS-3401_Datasheet.pdf"}
+    {"question": "max power of EGPS-3401", "contains": "EGPS-3401"}
+
+Usage:
+    python3 -m tools.retrieval_eval -f eval.jsonl -m vector hybrid -k 1 5 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from typing import List
+
+from llama_index.core.schema import NodeWithScore
+
+from core.models import MinillmModel
+from service.pools.retriever import RetrieverService
+
+
+def _is_relevant(node: NodeWithScore, case: dict) -> bool:
+    if "file_name" in case and node.node.metadata.get("file_name") == case["file_name"]:
+        return True
+    if "contains" in case and case["contains"].lower() in node.node.get_content().lower():
+        return True
+    return False
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def evaluate(
+    retriever: RetrieverService, cases: List[dict], mode: str, ks: List[int]
+) -> dict:
+    latencies, ranks = [], []
+    for case in cases:
+        start = time.perf_counter()
+        nodes = await retriever.aretrieve(data=case["question"], mode=mode)
+        latencies.append(time.perf_counter() - start)
+        rank = next(
+            (i for i, node in enumerate(nodes, start=1) if _is_relevant(node, case)),
+            None,
+        )
+        ranks.append(rank)
+    return {
+        "mode": mode,
+        "recall": {
+            k: sum(rank is not None and rank <= k for rank in ranks) / len(ranks)
+            for k in ks
+        },
+        "mrr": sum(1 / rank for rank in ranks if rank) / len(ranks),
+        "latency_mean": statistics.mean(latencies),
+        "latency_p50": _percentile(latencies, 0.5),
+        "latency_p95": _percentile(latencies, 0.95),
+    }
+
+
+async def main(path: str, modes: List[str], ks: List[int]) -> None:
+    with open(path, encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    model = MinillmModel(
+        host=os.environ.get("OllAMA_HOST", "127.0.0.1"),
+        port=os.environ.get("OllAMA_PORT", "11434"),
+    )
+    retriever = RetrieverService(text_emb_model=model, top_k=max(ks))
+    # warm up connections and the full-text index so the first mode is not penalized
+    for mode in modes:
+        await retriever.aretrieve(data=cases[0]["question"], mode=mode)
+
+    print(f"{len(cases)} questions")
+    for mode in modes:
+        result = await evaluate(retriever, cases, mode=mode, ks=ks)
+        recall = "  ".join(f"R@{k} {v:.3f}" for k, v in result["recall"].items())
+        print(
+            f"{mode:>7}  {recall}  MRR {result['mrr']:.3f}  "
+            f"latency mean {result['latency_mean'] * 1000:.1f}ms "
+            f"p50 {result['latency_p50'] * 1000:.1f}ms p95 {result['latency_p95'] * 1000:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrieval latency and recall per mode.")
+    parser.add_argument("-f", "--file", required=True, help="JSONL eval set.")
+    parser.add_argument(
+        "-m", "--modes", nargs="+", default=["vector", "hybrid"], choices=["vector", "hybrid"]
+    )
+    parser.add_argument("-k", "--top_k", nargs="+", default=[1, 5, 10], type=int)
+    args = parser.parse_args()
+    asyncio.run(main(path=args.file, modes=args.modes, ks=sorted(args.top_k)))
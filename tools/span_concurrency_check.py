@@ -0,0 +1,65 @@
+"""
+Check that parallel chats never get each other's span id.
+
+Every chat runs Llama31Model.arun against a mocked Ollama inside its own
+OpenTelemetry span and compares the span id handed back through
+tools.trace_context with the span it was generated in.
+
+Usage:
+    python3 -m tools.span_concurrency_check -n 500
+"""
+
+import argparse
+import asyncio
+import json
+import random
+
+import httpx
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+
+from core.models import HttpPool, Llama31Model
+from tools.trace_context import get_span_id, new_request
+
+
+async def _mock_ollama(request: httpx.Request) -> httpx.Response:
+    # random delay so that generations of different chats interleave
+    await asyncio.sleep(random.uniform(0, 0.05))
+    lines = "".join(
+        json.dumps({"message": {"content": token}}) + "\n" for token in ["a", "b"]
+    )
+    return httpx.Response(
+        200, content=lines.encode(), headers={"Transfer-Encoding": "chunked"}
+    )
+
+
+async def _chat(model: Llama31Model, tracer: trace.Tracer) -> bool:
+    new_request()
+    with tracer.start_as_current_span("chat") as span:
+        expected = span.get_span_context().span_id.to_bytes(8, "big").hex()
+        async for _ in model.arun(prompt=[{"role": "user", "content": "hi"}]):
+            await asyncio.sleep(0)
+    return get_span_id() == expected
+
+
+async def main(chats: int) -> None:
+    trace.set_tracer_provider(TracerProvider())
+    tracer = trace.get_tracer(__name__)
+
+    pool = HttpPool()
+    pool._aclient = httpx.AsyncClient(transport=httpx.MockTransport(_mock_ollama))
+    model = Llama31Model(pool=pool)
+
+    results = await asyncio.gather(*(_chat(model, tracer) for _ in range(chats)))
+    await pool.aclose()
+    mismatches = results.count(False)
+    print(f"{chats} parallel chats, {mismatches} span id mismatches")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Span id cross-talk check.")
+    parser.add_argument("-n", "--chats", default=200, type=int)
+    args = parser.parse_args()
+    asyncio.run(main(chats=args.chats))
@@ -0,0 +1,98 @@
+import re
+from typing import Optional
+
+from tools.logger import config_logger
+
+# init log
+LOGGER = config_logger(
+    log_name="tokenizer.log",
+    logger_name="tokenizer",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
+
+# Roughly one token per word piece: runs of letters/digits count one token per
+# 4 characters, every other non-space character counts as one token.
+_PIECE = re.compile(r"[A-Za-z0-9]+|[^\sA-Za-z0-9]")
+
+
+def _piece_tokens(piece: str) -> int:
+    return (len(piece) + 3) // 4 if piece[0].isalnum() and piece.isascii() else 1
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimate the number of llama3.1 tokens of a text without loading a tokenizer.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return sum(_piece_tokens(piece) for piece in _PIECE.findall(text))
+
+
+class TokenCounter:
+    """
+    Count and truncate tokens with a HuggingFace tokenizer, or with the `count_tokens` estimate.
+
+    Pass the tokenizer of the generation model (e.g. a local copy of
+    "meta-llama/Meta-Llama-3.1-8B-Instruct", needs transformers) for exact counts.
+    Without one, or when transformers or the tokenizer files are missing, the
+    estimate is used and a warning is logged.
+
+    Attributes:
+        name (str): Name of the tokenizer in use, "heuristic" for the estimate.
+
+    Methods:
+        count(text: str) -> int:
+            Count the tokens of a text.
+
+        truncate(text: str, max_tokens: int) -> str:
+            Cut a text down to at most max_tokens tokens.
+    """
+
+    def __init__(self, tokenizer: Optional[str] = None) -> None:
+        """
+        Initialize the TokenCounter.
+
+        Args:
+            tokenizer (Optional[str]): HuggingFace name or local path of the tokenizer, None uses the estimate. Defaults to None.
+        """
+        self.name = "heuristic"
+        self._tokenizer = None
+        if not tokenizer:
+            LOGGER.warning(
+                "No tokenizer given, token budgets use the estimate. Set PROMPT_TOKENIZER for exact counts."
+            )
+        else:
+            try:
+                from transformers import AutoTokenizer
+
+                self._tokenizer = AutoTokenizer.from_pretrained(tokenizer)
+                self.name = tokenizer
+            except Exception as e:
+                LOGGER.warning(
+                    f"Can not load tokenizer '{tokenizer}', token budgets use the estimate: {e}"
+                )
+        LOGGER.info(f"Count tokens with '{self.name}'.")
+
+    def count(self, text: str) -> int:
+        if self._tokenizer is None:
+            return count_tokens(text)
+        return len(self._tokenizer.encode(text, add_special_tokens=False))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        if self._tokenizer is not None:
+            ids = self._tokenizer.encode(text, add_special_tokens=False)
+            return self._tokenizer.decode(ids[:max_tokens])
+        used = 0
+        for match in _PIECE.finditer(text):
+            used += _piece_tokens(match.group())
+            if used > max_tokens:
+                return text[: match.start()].rstrip()
+        return text
@@ -0,0 +1,51 @@
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+
+# Per-request values. Every request runs in its own context (asyncio task or
+# worker thread), so concurrent chats never see each other's values.
+_SPAN_ID: ContextVar[Optional[str]] = ContextVar("span_id", default=None)
+_REQUEST_ID: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+def new_request() -> str:
+    """
+    Start a new request in the current context.
+
+    Returns:
+        str: The new request id.
+    """
+    request_id = uuid.uuid4().hex
+    _REQUEST_ID.set(request_id)
+    _SPAN_ID.set(None)
+    return request_id
+
+
+def get_request_id() -> Optional[str]:
+    """
+    Get the request id of the current context.
+
+    Returns:
+        Optional[str]: The request id, None outside of a request.
+    """
+    return _REQUEST_ID.get()
+
+
+def set_span_id(span_id: Optional[str]) -> None:
+    """
+    Save the span id of the generation for the current request.
+
+    Args:
+        span_id (Optional[str]): The span id.
+    """
+    _SPAN_ID.set(span_id)
+
+
+def get_span_id() -> Optional[str]:
+    """
+    Get the span id of the generation for the current request.
+
+    Returns:
+        Optional[str]: The span id, None if nothing was generated yet.
+    """
+    return _SPAN_ID.get()
@@ -1,10 +1,27 @@
-import copy
+import asyncio
+import atexit
 import json
 import logging
 import os
+import queue
+import sqlite3
+import threading
 import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 
-from tools.logger import config_logger
+from tools.logger import close_logger_files, config_logger
+from tools.metrics import timer
+from tools.redis_handler import RedisNotifier
+
+# init log
+LOGGER = config_logger(
+    log_name="user_register.log",
+    logger_name="user_register",
+    default_folder="./log",
+    write_mode="w",
+    level="debug",
+)
 
 
 class UserHandler:
@@ -12,55 +29,205 @@ class UserHandler:
     UserHandler class.
 
     This class handles user information and logging for a user feedback system.
+    Users are kept in memory, keyed by (department, username), and persisted in
+    SQLite by a background writer, so a registration never waits for the disk.
+    Per-user loggers are created on first use; only the `max_open_logs` most
+    recently used ones keep their file open, the others are closed and reopen
+    in append mode when they log again. With a Redis connection the registry is
+    shared by all the workers of the service: a user registered by one worker is
+    found in Redis by the others.
 
     Methods:
-        register(username: str, department: str) -> dict:
+        register(username: str, department: str) -> None:
             Register a new user.
 
         check(username: str, department: str) -> bool:
             Check if a user is already registered.
 
-        get(username: str, department: str) -> dict:
+        acheck(username: str, department: str) -> bool:
+            Check if a user is already registered without blocking the event loop.
+
+        get(username: str, department: str) -> logging.Logger:
             Get the logger for a user.
+
+        user_id(username: str, department: str) -> str:
+            Normalized identity of a user, e.g. for the conversation memory.
+
+        flush() -> None:
+            Wait until the pending registrations are persisted.
+
+        close() -> None:
+            Persist the pending registrations and stop the writer.
     """
 
-    def __init__(self, user_info_path: str = "./feedback/user_info.json") -> None:
+    def __init__(
+        self,
+        user_info_path: str = "./feedback/user_info.json",
+        db_path: str = "./feedback/users.db",
+        batch_size: int = 256,
+        max_open_logs: int = 256,
+        redis: Optional[RedisNotifier] = None,
+        redis_key: str = "users",
+    ) -> None:
         """
         Initialize the UserHandler class.
 
         Args:
-            user_info_path (str): Path to the user information JSON file. Defaults to "./feedback/user_info.json".
+            user_info_path (str): Path to the legacy user information JSON file, migrated into the database once. Defaults to "./feedback/user_info.json".
+            db_path (str): Path to the SQLite database of the users. Defaults to "./feedback/users.db".
+            batch_size (int): Maximum number of registrations written per transaction. Defaults to 256.
+            max_open_logs (int): Maximum number of user log files kept open. Defaults to 256.
+            redis (Optional[RedisNotifier]): Redis connection sharing the registry across workers, None keeps it in process.
+            redis_key (str): Redis hash of the registered users. Defaults to "users".
         """
-        self.users_info = self._load(path=user_info_path)
+        if max_open_logs < 1:
+            raise ValueError("max_open_logs must be greater than 0!")
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.max_open_logs = max_open_logs
+        self.redis = redis
+        self.redis_key = redis_key
+        self._lock = threading.Lock()
+        # least recently used first
+        self._logs: "OrderedDict[Tuple[str, str], logging.Logger]" = OrderedDict()
+        self._pending: queue.Queue = queue.Queue()
+        self.users_info = self._load(db_path=db_path, user_info_path=user_info_path)
+        self._publish(self.users_info)
+        self._writer = threading.Thread(
+            target=self._write_behind, name="user-register-writer", daemon=True
+        )
+        self._writer.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _connect(db_path: str) -> sqlite3.Connection:
+        folder = os.path.dirname(db_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # several workers may write the same database
+        connection = sqlite3.connect(db_path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "department TEXT NOT NULL, username TEXT NOT NULL, create_time REAL NOT NULL, "
+            "PRIMARY KEY (department, username))"
+        )
+        return connection
 
-    def _load(self, path) -> dict:
+    def _load(self, db_path: str, user_info_path: str) -> Dict[Tuple[str, str], dict]:
         """
-        Load user information from a JSON file.
+        Load user information from the database, migrating the legacy JSON file into an empty one.
 
         Args:
-            path (str): Path to the user information JSON file.
+            db_path (str): Path to the SQLite database.
+            user_info_path (str): Path to the legacy user information JSON file.
 
         Returns:
-            dict: A dictionary containing user information.
+            Dict[Tuple[str, str], dict]: User information keyed by (department, username).
         """
-        users_info = {}
-        if os.path.exists(path):
-            with open(path) as json_file:
-                users_info = json.load(json_file)
+        start = time.perf_counter()
+        connection = self._connect(db_path)
+        try:
+            rows = connection.execute(
+                "SELECT department, username, create_time FROM users"
+            ).fetchall()
+            if not rows and os.path.exists(user_info_path):
+                rows = self._migrate(connection, user_info_path)
+        finally:
+            connection.close()
+        users_info = {
+            (department, username): {"name": username, "create_time": create_time}
+            for department, username, create_time in rows
+        }
+        LOGGER.info(
+            f"Load {len(users_info)} users from '{db_path}' in {time.perf_counter() - start:.3f}s."
+        )
+        return users_info
 
-            users_info_copy = copy.deepcopy(users_info)
-            for department, user_info in users_info_copy.items():
-                users_info[department]["log"] = self._create_log(
-                    username=user_info["name"], department=department
-                )
-                now_time = time.time()
-                if user_info.__contains__("create_time"):
-                    users_info[department]["reload_time"] = now_time
+    @staticmethod
+    def _migrate(connection: sqlite3.Connection, user_info_path: str) -> list:
+        with open(user_info_path) as json_file:
+            users_info = json.load(json_file)
+        # legacy layout: {department: {"name": username, "create_time": time}}
+        rows = [
+            (department.lower(), user_info["name"].lower(), user_info.get("create_time", time.time()))
+            for department, user_info in users_info.items()
+        ]
+        with connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO users (department, username, create_time) VALUES (?, ?, ?)",
+                rows,
+            )
+        LOGGER.info(f"Migrate {len(rows)} users from '{user_info_path}'.")
+        return rows
 
-                else:
-                    users_info[department]["create_time"] = now_time
+    @staticmethod
+    def _field(key: Tuple[str, str]) -> str:
+        return f"{key[0]}:{key[1]}"
 
-        return users_info
+    def _publish(self, users_info: Dict[Tuple[str, str], dict]) -> None:
+        """
+        Copy users into the shared Redis registry, e.g. after Redis lost its data.
+
+        Args:
+            users_info (Dict[Tuple[str, str], dict]): User information keyed by (department, username).
+        """
+        if self.redis is None or not users_info:
+            return
+        try:
+            pipeline = self.redis.cursor.pipeline(transaction=False)
+            for key, user_info in users_info.items():
+                pipeline.hsetnx(self.redis_key, self._field(key), user_info["create_time"])
+            with timer("redis"):
+                pipeline.execute()
+        except Exception as e:
+            LOGGER.error(f"Can not publish {len(users_info)} users to Redis: {e}")
+
+    def _lookup_shared(self, key: Tuple[str, str]) -> bool:
+        # registered by another worker after this one loaded the database
+        if self.redis is None:
+            return False
+        try:
+            with timer("redis"):
+                create_time = self.redis.cursor.hget(self.redis_key, self._field(key))
+        except Exception as e:
+            LOGGER.error(f"Can not look up user '{self._field(key)}' in Redis: {e}")
+            return False
+        if create_time is None:
+            return False
+        with self._lock:
+            self.users_info.setdefault(
+                key, {"name": key[1], "create_time": float(create_time)}
+            )
+        return True
+
+    def _write_behind(self) -> None:
+        connection = self._connect(self.db_path)
+        try:
+            while True:
+                row = self._pending.get()
+                batch = [row]
+                while row is not None and len(batch) < self.batch_size:
+                    try:
+                        row = self._pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    batch.append(row)
+                rows = [row for row in batch if row is not None]
+                try:
+                    with connection:
+                        connection.executemany(
+                            "INSERT OR IGNORE INTO users (department, username, create_time) VALUES (?, ?, ?)",
+                            rows,
+                        )
+                except sqlite3.Error as e:
+                    LOGGER.error(f"Can not persist {len(rows)} users: {e}")
+                for _ in batch:
+                    self._pending.task_done()
+                if None in batch:
+                    return
+        finally:
+            connection.close()
 
     def _create_log(self, username: str, department: str) -> logging.Logger:
         """
@@ -77,58 +244,46 @@ class UserHandler:
             log_name=f"{department}_{username}.log",
             logger_name=f"{department}_{username}",
             default_folder="./feedback",
-            write_mode="w",
+            # keep the history: loggers are created lazily, in every worker
+            write_mode="a",
             level="debug",
         )
         return log
 
-    def _save(
-        self,
-        users_info: dict,
-        save_folder: str = "./feedback/",
-        file_name: str = "user_info.json",
-    ) -> None:
+    def register(self, username: str, department: str) -> None:
         """
-        Save user information to a JSON file.
+        Register a new user, the database is updated in the background.
 
         Args:
-            users_info (dict): A dictionary containing user information.
-            save_folder (str): Folder to save the JSON file. Defaults to "./feedback/".
-            file_name (str): Name of the JSON file. Defaults to "user_info.json".
+            username (str): The username to register.
+            department (str): The department the user belongs to.
         """
-        if not os.path.isdir(save_folder):
-            os.makedirs(save_folder)
+        key = (department.lower(), username.lower())
+        with self._lock:
+            if key in self.users_info:
+                return
+            now_time = time.time()
+            self.users_info[key] = {"name": key[1], "create_time": now_time}
+        self._publish({key: self.users_info[key]})
+        self._pending.put((key[0], key[1], now_time))
 
-        file_path = os.path.join(save_folder, file_name)
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(users_info, f, ensure_ascii=False, indent=4)
-
-    def register(self, username: str, department: str) -> dict:
+    def check(self, username: str, department: str) -> bool:
         """
-        Register a new user.
+        Check if a user is already registered.
 
         Args:
-            username (str): The username to register.
+            username (str): The username to check.
             department (str): The department the user belongs to.
 
         Returns:
-            dict: Updated user information dictionary.
-        """
-        username = username.lower()
-        department = department.lower()
-        now_time = time.time()
-        log = self._create_log(username=username, department=department)
-        self.users_info.update(
-            {department: {"name": username, "create_time": now_time}}
-        )
-        if self.users_info[department].__contains__("log"):
-            del self.users_info[department]["log"]
-        self._save(users_info=self.users_info)
-        self.users_info[department]["log"] = log
+            bool: True if the user is registered, False otherwise.
+        """
+        key = (department.lower(), username.lower())
+        return key in self.users_info or self._lookup_shared(key)
 
-    def check(self, username: str, department: str) -> bool:
+    async def acheck(self, username: str, department: str) -> bool:
         """
-        Check if a user is already registered.
+        Check if a user is already registered, the Redis lookup runs in a worker thread.
 
         Args:
             username (str): The username to check.
@@ -137,14 +292,14 @@ class UserHandler:
         Returns:
             bool: True if the user is registered, False otherwise.
         """
-        username = username.lower()
-        department = department.lower()
-        if department in self.users_info:
-            if self.users_info[department]["name"] == username:
-                return True
-        return False
+        key = (department.lower(), username.lower())
+        if key in self.users_info:
+            return True
+        if self.redis is None:
+            return False
+        return await asyncio.to_thread(self._lookup_shared, key)
 
-    def get(self, username: str, department: str) -> dict:
+    def get(self, username: str, department: str) -> logging.Logger:
         """
         Get the logger for a user.
 
@@ -153,9 +308,47 @@ class UserHandler:
             department (str): The department the user belongs to.
 
         Returns:
-            dict: The logger for the user.
+            logging.Logger: The logger for the user.
         """
-        username = username.lower()
-        department = department.lower()
+        key = (department.lower(), username.lower())
+        if key not in self.users_info and not self._lookup_shared(key):
+            raise KeyError(f"User '{username}' of '{department}' has not registered yet.")
+        with self._lock:
+            log = self._logs.get(key)
+            if log is not None:
+                self._logs.move_to_end(key)
+                return log
+            log = self._logs[key] = self._create_log(username=key[1], department=key[0])
+            if len(self._logs) > self.max_open_logs:
+                _, evicted = self._logs.popitem(last=False)
+                close_logger_files(evicted.name)
+        return log
+
+    def user_id(self, username: str, department: str) -> str:
+        """
+        Normalized identity of a user, the same however the name is typed.
+
+        Args:
+            username (str): The username.
+            department (str): The department the user belongs to.
+
+        Returns:
+            str: "<department>:<username>" in lower case.
+        """
+        return self._field((department.lower(), username.lower()))
+
+    def flush(self) -> None:
+        self._pending.join()
+
+    def close(self) -> None:
+        if self._writer.is_alive():
+            self._pending.put(None)
+            self._writer.join()
+
 
-        return self.users_info[department]["log"]
+if __name__ == "__main__":
+    user_handler = UserHandler()
+    user_handler.register(username="Tom", department="RD")
+    print(user_handler.check(username="tom", department="rd"))
+    user_handler.get(username="tom", department="rd").info("Hello!")
+    user_handler.close()
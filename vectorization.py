@@ -52,6 +52,65 @@ def build_argparser():
         default="default",
         help="the rag method to create vectorization data , you can use 'ai' to get the best data.",
     )
+    args.add_argument(
+        "-b",
+        "--batch_size",
+        default=64,
+        type=int,
+        help="number of chunks sent to the embedding model per request.",
+    )
+    args.add_argument(
+        "-c",
+        "--concurrency",
+        default=4,
+        type=int,
+        help="maximum number of embedding batches in flight.",
+    )
+    args.add_argument(
+        "--file_workers",
+        default=1,
+        type=int,
+        help="number of files read in parallel.",
+    )
+    args.add_argument(
+        "-w",
+        "--workers",
+        default=0,
+        type=int,
+        help="number of processes reading and splitting files with the default tools, 0 reads in the main process.",
+    )
+    args.add_argument(
+        "--page_workers",
+        default=4,
+        type=int,
+        help="maximum number of PDF pages converted at the same time with '-tools ai'.",
+    )
+    args.add_argument(
+        "--markdown_cache",
+        default="./cache/ai_markdown.sqlite",
+        help="path of the cache of the markdown generated by '-tools ai'.",
+    )
+    args.add_argument(
+        "--no_markdown_cache",
+        action="store_true",
+        help="convert every page with the llm even if it is cached.",
+    )
+    args.add_argument(
+        "--copy_chunk_size",
+        default=5000,
+        type=int,
+        help="number of rows written to postgres per COPY transaction.",
+    )
+    args.add_argument(
+        "--rebuild_index",
+        action="store_true",
+        help="drop the HNSW index during the run and build it once at the end, faster for large loads.",
+    )
+    args.add_argument(
+        "--full",
+        action="store_true",
+        help="clear the table and rebuild it instead of ingesting only new or changed files.",
+    )
     return parser
 
 
@@ -65,6 +124,8 @@ if __name__ == "__main__":
     data_folder = str(args.data_folder)
     table_name = str(args.table_name)
     tools = str(args.tools)
+    batch_size = int(args.batch_size)
+    concurrency = int(args.concurrency)
 
     text_emb_model = MinillmModel(host=model_server_url, port=model_server_port)
     # img_emb_model = ClipModel()
@@ -73,9 +134,19 @@ if __name__ == "__main__":
     #     text_emb_model=text_emb_model, img_emb_model=img_emb_model, recreate=recreate
     # )
     rag_service = VectorizationService(
-        text_emb_model=text_emb_model, table_name=table_name, tools=tools
+        text_emb_model=text_emb_model,
+        table_name=table_name,
+        tools=tools,
+        batch_size=batch_size,
+        max_concurrency=concurrency,
+        file_workers=int(args.file_workers),
+        page_workers=int(args.page_workers),
+        markdown_cache=None if args.no_markdown_cache else str(args.markdown_cache),
+        copy_chunk_size=int(args.copy_chunk_size),
+        rebuild_index=args.rebuild_index,
+        workers=int(args.workers),
     )
-    rag_service.run(data_folder=data_folder)
+    rag_service.run(data_folder=data_folder, full=args.full)
     print(
         f"Success update vector db! data path:{data_folder} ,tools : {tools}, more message plz see logs!"
     )